@@ -0,0 +1,103 @@
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, PlainTextResponse
+from starlette.routing import Route
+from slack_bot import slack_events_async, event_queue, event_dedup
+from discord_bot import discord_client
+import http_session
+import http_log
+import metrics
+from dispatcher import outbound
+import uvicorn
+import asyncio
+import config
+
+# ASGI-вариант main.py: веб-сервер и Discord-клиент работают в одном event loop,
+# поэтому события Slack обрабатываются как обычные корутины, без потоков
+
+
+def audited(handler):
+    """Record the request/response pair in the HTTP audit log, as main.py's after_request hook does."""
+    async def endpoint(request):
+        response = await handler(request)
+        # The Slack payload and response are reused as parsed by the view
+        slack_payload = getattr(request.state, 'slack_payload', None)
+        slack_response = getattr(request.state, 'slack_response', None)
+        http_log.log_exchange(
+            request.method,
+            str(request.url),
+            dict(request.headers),
+            slack_payload if slack_payload is not None else await request.body(),
+            response.status_code,
+            dict(response.headers),
+            slack_response if slack_response is not None else response.body
+        )
+        return response
+    return endpoint
+
+
+async def home(request):
+    return PlainTextResponse('Both bots are running')
+
+
+async def metrics_route(request):
+    return PlainTextResponse(metrics.render(), media_type='text/plain; version=0.0.4')
+
+
+async def slack_events(request):
+    status, response, event_data = await slack_events_async(await request.body(), request.headers)
+    request.state.slack_payload = event_data
+    request.state.slack_response = response
+    return JSONResponse(response, status_code=status)
+
+
+async def queue_stats(request):
+    if event_queue is None:
+        return JSONResponse({"mode": "inline"})
+    return JSONResponse({"mode": "queue", **event_queue.stats()})
+
+
+async def dedup_stats(request):
+    return JSONResponse(event_dedup.stats())
+
+
+async def http_stats(request):
+    return JSONResponse(http_session.stats())
+
+
+async def outbound_stats(request):
+    return JSONResponse(outbound.stats())
+
+
+app = Starlette(routes=[
+    Route('/', audited(home)),
+    Route('/metrics', audited(metrics_route)),
+    Route('/slack/events', audited(slack_events), methods=['POST']),
+    Route('/queue', audited(queue_stats)),
+    Route('/dedup', audited(dedup_stats)),
+    Route('/http', audited(http_stats)),
+    Route('/outbound', audited(outbound_stats)),
+])
+
+
+async def run():
+    """Serve the webhook and run the Discord client on the current loop until either stops."""
+    server = uvicorn.Server(uvicorn.Config(
+        app,
+        host=config.WEB_HOST,
+        port=config.WEB_PORT,
+        lifespan='off',
+        timeout_keep_alive=config.WEB_KEEP_ALIVE_TIMEOUT
+    ))
+
+    async with discord_client:
+        discord_task = asyncio.create_task(discord_client.start(config.TOKEN_DISCORD))
+        # If the gateway connection dies for good, stop serving as well
+        discord_task.add_done_callback(lambda task: setattr(server, 'should_exit', True))
+        try:
+            await server.serve()
+        finally:
+            await discord_client.close()
+            discord_error, = await asyncio.gather(discord_task, return_exceptions=True)
+
+    if isinstance(discord_error, Exception):
+        raise discord_error
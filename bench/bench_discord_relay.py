@@ -0,0 +1,101 @@
+"""Benchmark of relaying concurrent Discord messages to Slack.
+
+--messages stub Discord messages, spread over the four bridged channels, go
+through discord_bot.send_new_message_to_slack at once. chat_postMessage is a
+stub that takes --latency seconds, either awaited (the AsyncWebClient) or
+blocking the loop (how the synchronous WebClient behaved when called from a
+Discord handler). A heartbeat task measures how late the loop gets to it,
+i.e. how long gateway events would have waited.
+
+The dispatcher's rate limits are lifted; its one-send-per-channel ordering is
+kept, so at most one message per channel is in flight.
+
+    python bench/bench_discord_relay.py --messages 200 --latency 0.05
+"""
+from types import SimpleNamespace
+import itertools
+import argparse
+import asyncio
+import time
+import harness
+
+CHANNELS = {'GENERAL': 1001, 'RANDOM': 1002, 'MADE_IN_HACKLAB': 1003, 'TEST': harness.DISCORD_CHANNEL}
+
+harness.configure(**{
+    key: value
+    for name, discord_id in CHANNELS.items()
+    for key, value in ((f'SLACK_CHANNEL_{name}', f'CBENCH{discord_id}'), (f'DISCORD_CHANNEL_{name}', discord_id))
+})
+slack_bot, discord_bot = harness.import_bots()
+from dispatcher import outbound
+import db
+
+_ts = itertools.count(1)
+
+
+def stub_message(i):
+    channel_id = list(CHANNELS.values())[i % len(CHANNELS)]
+    author = SimpleNamespace(id=i % 7, display_name=f'user{i % 7}')
+    return SimpleNamespace(
+        id=10_000 + i, content=f'message {i}', attachments=[], mentions=[], author=author,
+        channel=SimpleNamespace(id=channel_id, name=f'channel-{channel_id}'),
+    )
+
+
+def stub_post(latency, blocking):
+    async def chat_postMessage(channel, text, **kwargs):
+        if blocking:
+            time.sleep(latency)
+        else:
+            await asyncio.sleep(latency)
+        return {'ok': True, 'ts': f'{1700000000 + next(_ts)}.000100'}
+    return chat_postMessage
+
+
+async def heartbeat(interval, lags, stop):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        lags.append(loop.time() - expected)
+
+
+async def run(messages, latency, blocking):
+    discord_bot.async_slack_client.chat_postMessage = stub_post(latency, blocking)
+    lags, stop = [], asyncio.Event()
+    beat = asyncio.create_task(heartbeat(0.005, lags, stop))
+    await asyncio.sleep(0.01)
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(discord_bot.send_new_message_to_slack(stub_message(i)) for i in range(messages)))
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    await beat
+    relayed = sum('"ok"' in result for result in results)
+    return elapsed, relayed, max(lags)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.05, help='simulated Slack round trip, seconds')
+    args = parser.parse_args()
+
+    for discord_id in CHANNELS.values():
+        slack_bot.channel_directory.cache.set(f'CBENCH{discord_id}', f'channel-{discord_id}')
+    db.ensure_indexes()
+    harness.unthrottle(outbound)
+
+    rows = []
+    for label, blocking in (('async client', False), ('blocking client', True)):
+        elapsed, relayed, max_lag = asyncio.run(run(args.messages, args.latency, blocking))
+        rows.append((label, f'{elapsed:6.2f}s for {relayed} messages ({relayed / elapsed:6.1f} msg/s), '
+                            f'loop stalled up to {max_lag * 1e3:7.1f} ms'))
+    db.shutdown()
+
+    harness.report(f'{args.messages} messages over {len(CHANNELS)} channels, {args.latency * 1e3:.0f} ms per Slack call', rows)
+
+
+if __name__ == '__main__':
+    main()
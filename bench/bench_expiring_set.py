@@ -0,0 +1,106 @@
+"""Benchmark of the file_share dedup: cache.ExpiringSet against the scan it replaced.
+
+The old dedup kept a set of file IDs next to a dict of their timestamps and, on
+every file_share event, scanned the whole dict for expired entries. Both are
+measured holding --ids file IDs (100k by default):
+
+  * ExpiringSet: filling it, then new and duplicate IDs at that size, then a
+    mass expiry when every member's TTL has passed;
+  * the old scan: new IDs at that size (filling it through the scan is
+    quadratic, so it is filled directly);
+  * ExpiringSet from several threads adding overlapping IDs, where each ID must
+    be reported new exactly once.
+
+    python bench/bench_expiring_set.py --ids 100000
+"""
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import time
+import harness
+
+harness.configure()
+from cache import ExpiringSet
+
+
+class ScanDedup:
+    """The file dedup before ExpiringSet, reduced to its data structures."""
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.processed_files = set()
+        self.file_timestamps = {}
+
+    def add(self, file_id):
+        current_time = time.time()
+        expired_files = [key for key, timestamp in self.file_timestamps.items() if current_time - timestamp > self.ttl]
+        for key in expired_files:
+            self.processed_files.remove(key)
+            del self.file_timestamps[key]
+
+        if file_id in self.processed_files:
+            return False
+        self.processed_files.add(file_id)
+        self.file_timestamps[file_id] = current_time
+        return True
+
+
+def per_call_us(function, keys):
+    started = time.perf_counter()
+    for key in keys:
+        function(key)
+    return (time.perf_counter() - started) / len(keys) * 1e6
+
+
+def file_id(i):
+    return f'F{i:010d}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--ids', type=int, default=100_000)
+    parser.add_argument('--scan-events', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=4)
+    args = parser.parse_args()
+    count = args.ids
+    rows = []
+
+    expiring = ExpiringSet(ttl=300)
+    rows.append(('ExpiringSet fill', f'{per_call_us(expiring.add, [file_id(i) for i in range(count)]):8.2f} us/add'))
+    rows.append(('ExpiringSet new ID', f'{per_call_us(expiring.add, [file_id(i) for i in range(count, 2 * count)]):8.2f} us/add'))
+    rows.append(('ExpiringSet duplicate ID', f'{per_call_us(expiring.add, [file_id(i) for i in range(count)]):8.2f} us/add'))
+
+    # Все записи с истёкшим TTL: следующий add выбрасывает их разом
+    short = ExpiringSet(ttl=0.5)
+    for i in range(count):
+        short.add(file_id(i))
+    time.sleep(0.6)
+    started = time.perf_counter()
+    short.add('F-after-expiry')
+    rows.append((f'ExpiringSet expire {count}', f'{(time.perf_counter() - started) * 1e3:8.2f} ms once, then {len(short)} member'))
+
+    scan = ScanDedup(ttl=300)
+    now = time.time()
+    for i in range(count):
+        scan.processed_files.add(file_id(i))
+        scan.file_timestamps[file_id(i)] = now
+    new_ids = [file_id(i) for i in range(count, count + args.scan_events)]
+    rows.append(('old scan new ID', f'{per_call_us(scan.add, new_ids):8.2f} us/add'))
+
+    shared = ExpiringSet(ttl=300)
+    overlapping = [file_id(i % count) for i in range(count * 2)]
+    chunk = len(overlapping) // args.threads
+    with ThreadPoolExecutor(args.threads) as workers:
+        started = time.perf_counter()
+        reported_new = sum(workers.map(
+            lambda part: sum(shared.add(key) for key in overlapping[part * chunk:(part + 1) * chunk]),
+            range(args.threads)
+        ))
+        elapsed = time.perf_counter() - started
+    rows.append((f'ExpiringSet {args.threads} threads', f'{elapsed / len(overlapping) * 1e6:8.2f} us/add, '
+                 f'{reported_new} reported new for {len(set(overlapping))} distinct IDs'))
+
+    harness.report(f'file dedup holding {count} IDs', rows)
+
+
+if __name__ == '__main__':
+    main()
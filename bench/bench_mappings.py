@@ -0,0 +1,109 @@
+"""Micro-benchmark of message-ID mapping lookups on a large SQLite store.
+
+Fills a throwaway SQLiteBackend with --mappings pairs (1M by default), then times:
+
+  * indexed lookups straight on the backend, in both directions;
+  * db.get_discord_message_id / db.get_slack_message_id, i.e. through the LRU
+    caches after a warm-up, with a skewed key mix where 90% of lookups hit the
+    newest 1% of messages;
+  * the backend lookups again with the indexes dropped (a full table scan each,
+    as before ensure_indexes existed), on a smaller sample.
+
+    python bench/bench_mappings.py --mappings 1000000
+"""
+import statistics
+import argparse
+import random
+import time
+import harness
+
+harness.configure(MAPPING_WRITE_BEHIND=0)
+import config
+import db
+
+
+def slack_ts(i):
+    return f'{1600000000 + i}.000100'
+
+
+def discord_id(i):
+    return 900_000_000_000_000_000 + i
+
+
+def timed(lookup, keys):
+    """Per-call latencies of `lookup` over `keys`, in microseconds."""
+    latencies = []
+    for key in keys:
+        started = time.perf_counter()
+        lookup(key)
+        latencies.append((time.perf_counter() - started) * 1e6)
+    return latencies
+
+
+def summary(latencies):
+    latencies = sorted(latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    return f'mean {statistics.fmean(latencies):9.1f} us   p50 {latencies[len(latencies) // 2]:9.1f} us   p99 {p99:9.1f} us   (n={len(latencies)})'
+
+
+def populate(backend, count, batch=50_000):
+    started = time.perf_counter()
+    for first in range(0, count, batch):
+        backend.insert_many([(slack_ts(i), discord_id(i)) for i in range(first, min(first + batch, count))])
+    return time.perf_counter() - started
+
+
+def skewed_keys(count, lookups, rng):
+    # 90% of lookups go to the newest 1% of messages (replies land on recent ones)
+    recent = max(1, count // 100)
+    return [
+        count - 1 - rng.randrange(recent) if rng.random() < 0.9 else rng.randrange(count)
+        for _ in range(lookups)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mappings', type=int, default=1_000_000)
+    parser.add_argument('--lookups', type=int, default=20_000)
+    parser.add_argument('--scan-lookups', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+    backend = db.backend
+
+    print(f'store: {config.MAPPING_SQLITE_PATH}')
+    db.ensure_indexes()
+    print(f'inserted {args.mappings} mappings in {populate(backend, args.mappings):.1f}s')
+
+    keys = [rng.randrange(args.mappings) for _ in range(args.lookups)]
+    rows = [
+        ('indexed slack->discord', summary(timed(backend.find_discord_message_id, [slack_ts(i) for i in keys]))),
+        ('indexed discord->slack', summary(timed(backend.find_slack_message_id, [discord_id(i) for i in keys]))),
+    ]
+
+    # One untimed pass with another sample of the same mix fills the caches first
+    for i in skewed_keys(args.mappings, args.lookups, rng):
+        db.get_discord_message_id(slack_ts(i))
+        db.get_slack_message_id(discord_id(i))
+    for cache in (db.discord_ids_cache, db.slack_ids_cache):
+        cache.hits = cache.misses = 0
+
+    skewed = skewed_keys(args.mappings, args.lookups, rng)
+    rows.append(('cached slack->discord', summary(timed(db.get_discord_message_id, [slack_ts(i) for i in skewed]))))
+    rows.append(('cached discord->slack', summary(timed(db.get_slack_message_id, [discord_id(i) for i in skewed]))))
+    rows.append(('cache slack->discord', db.discord_ids_cache.stats()))
+    rows.append(('cache discord->slack', db.slack_ids_cache.stats()))
+
+    with backend._lock:
+        backend._conn.execute('DROP INDEX messages_slack_discord_id')
+        backend._conn.execute('DROP INDEX messages_discord_id')
+    scan_keys = keys[:args.scan_lookups]
+    rows.append(('no index slack->discord', summary(timed(backend.find_discord_message_id, [slack_ts(i) for i in scan_keys]))))
+    rows.append(('no index discord->slack', summary(timed(backend.find_slack_message_id, [discord_id(i) for i in scan_keys]))))
+
+    harness.report(f'{args.mappings} mappings, MAPPING_CACHE_SIZE={config.MAPPING_CACHE_SIZE}', rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""CPU micro-benchmark of the work done per Slack webhook request.
+
+Times, per request and on a realistic message event:
+
+  * JSON parsing: the json module against fastjson (orjson when installed);
+  * check_request as a whole (signature, one parse, event_id dedup) and the
+    signature check on its own;
+  * the HTTP audit log on the request thread: the old before/after_request
+    hooks, which parsed and re-serialised both bodies with indent=4 and
+    formatted the record in the thread, against http_log.log_exchange, which
+    only enqueues; and the listener's JSONLineFormatter, which now does the
+    formatting off the request thread.
+
+    python bench/bench_request_cpu.py --iterations 20000
+"""
+import argparse
+import queue
+import json
+import time
+import harness
+
+harness.configure(HTTP_LOG_SAMPLE_RATE=1.0)
+slack_bot, _ = harness.import_bots()
+from slack_sdk.signature import SignatureVerifier
+import fastjson
+import http_log
+
+signer = SignatureVerifier(harness.SIGNING_SECRET)
+
+
+def slack_payload(i):
+    text = f'Message {i} with a <@U0123ABCD> mention and a link <https://example.com/page|page>'
+    return {
+        'token': 'verificationtoken', 'team_id': 'T0123ABCD', 'api_app_id': 'A0123ABCD',
+        'type': 'event_callback', 'event_id': f'Ev{i:012d}', 'event_time': 1700000000 + i,
+        'authorizations': [{'enterprise_id': None, 'team_id': 'T0123ABCD', 'user_id': harness.BOT_ID,
+                            'is_bot': True, 'is_enterprise_install': False}],
+        'is_ext_shared_channel': False, 'event_context': '4-eyJldCI6Im1lc3NhZ2UiLCJ0aWQiOiJUMDEyM0FCQ0QifQ',
+        'event': {
+            'type': 'message', 'user': 'U0123ABCD', 'channel': harness.SLACK_CHANNEL, 'channel_type': 'channel',
+            'ts': f'{1700000000 + i}.000100', 'client_msg_id': '6f1c6f0e-6c4d-4a57-9d55-1e6f8d1f0a11',
+            'team': 'T0123ABCD', 'text': text,
+            'blocks': [{'type': 'rich_text', 'block_id': 'abc12', 'elements': [{'type': 'rich_text_section', 'elements': [
+                {'type': 'text', 'text': f'Message {i} with a '},
+                {'type': 'user', 'user_id': 'U0123ABCD'},
+                {'type': 'text', 'text': ' mention and a link '},
+                {'type': 'link', 'url': 'https://example.com/page', 'text': 'page'},
+                {'type': 'text', 'text': ' — и немного текста не в ASCII'},
+            ]}]}],
+        },
+    }
+
+
+def signed(body):
+    timestamp = str(int(time.time()))
+    return {
+        'Content-Type': 'application/json',
+        'User-Agent': 'Slackbot 1.0 (+https://api.slack.com/robots)',
+        'X-Slack-Request-Timestamp': timestamp,
+        'X-Slack-Signature': signer.generate_signature(timestamp=timestamp, body=body),
+    }
+
+
+def old_format_json(data):
+    # main.py before the change
+    try:
+        return json.dumps(json.loads(data), indent=4, ensure_ascii=False)
+    except (json.JSONDecodeError, TypeError):
+        return data
+
+
+def old_log_hooks(body, headers, response_body, response_headers):
+    """The request-thread work of the old before_request and after_request hooks, minus the file write."""
+    request_record = (
+        f"Incoming request:\nMethod: POST\nURL: http://localhost/slack/events\n"
+        f"Headers:\n{json.dumps(headers, indent=4, ensure_ascii=False)}\nBody:\n{old_format_json(body.decode())}"
+    )
+    response_record = (
+        f"Outgoing response:\nStatus: 200\n"
+        f"Headers:\n{json.dumps(response_headers, indent=4, ensure_ascii=False)}\nBody:\n{old_format_json(response_body)}"
+    )
+    return request_record, response_record
+
+
+def per_call_us(function, arguments):
+    started = time.perf_counter()
+    for argument in arguments:
+        function(*argument)
+    return (time.perf_counter() - started) / len(arguments) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=20_000)
+    args = parser.parse_args()
+    n = args.iterations
+
+    bodies = [json.dumps(slack_payload(i)).encode() for i in range(n)]
+    requests = [(body, signed(body)) for body in bodies]
+    response_headers = {'Content-Type': 'application/json', 'Content-Length': '20'}
+    rows = [('payload size', f'{sum(map(len, bodies)) // n} bytes')]
+
+    rows.append(('json.loads', f'{per_call_us(json.loads, [(body,) for body in bodies]):8.1f} us'))
+    rows.append((f'fastjson.loads ({"orjson" if fastjson.orjson else "json"})',
+                 f'{per_call_us(fastjson.loads, [(body,) for body in bodies]):8.1f} us'))
+    rows.append(('signature check', f'{per_call_us(slack_bot.signature_verifier.is_valid_request, requests):8.1f} us'))
+    rows.append(('check_request', f'{per_call_us(slack_bot.check_request, requests):8.1f} us'))
+
+    old_hooks = [(body, headers, '{"status": "queued"}', response_headers) for body, headers in requests]
+    rows.append(('old log hooks (request thread)', f'{per_call_us(old_log_hooks, old_hooks):8.1f} us'))
+
+    # Записи перехватываются до слушателя, чтобы отдельно измерить форматирование
+    captured = queue.SimpleQueue()
+    http_log.http_logger.handlers[0].queue = captured
+
+    def log_exchange(payload, headers):
+        http_log.log_exchange('POST', 'http://localhost/slack/events', headers, payload, 200, response_headers, {'status': 'queued'})
+
+    parsed = [(fastjson.loads(body), headers) for body, headers in requests]
+    rows.append(('log_exchange (request thread)', f'{per_call_us(log_exchange, parsed):8.1f} us'))
+
+    formatter = http_log.JSONLineFormatter(http_log.config.HTTP_LOG_REDACT_HEADERS)
+    records = [(captured.get_nowait(),) for _ in range(n)]
+    rows.append(('JSONLineFormatter (listener)', f'{per_call_us(formatter.format, records):8.1f} us'))
+
+    harness.report(f'per request, {n} iterations', rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+import tempfile
+import resource
+import sys
+import os
+
+# Общая подготовка для скриптов в bench/: окружение без сети и реальных токенов.
+# Скрипты запускаются из корня репозитория, например: python bench/bench_mappings.py
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+WORKDIR = tempfile.mkdtemp(prefix='relay-bench-')
+
+SLACK_CHANNEL = 'CBENCH'
+DISCORD_CHANNEL = 1000
+BOT_ID = 'UBENCHBOT'
+SIGNING_SECRET = 'bench-signing-secret'
+
+
+def configure(**overrides):
+    """Point config at throwaway files; must run before any module of the bot is imported."""
+    env = {
+        'SLACK_TOKEN': 'xoxb-bench',
+        'SIGNING_SECRET': SIGNING_SECRET,
+        'SLACK_CHANNEL_TEST': SLACK_CHANNEL,
+        'DISCORD_CHANNEL_TEST': str(DISCORD_CHANNEL),
+        'SLACK_EVENTS_MODE': 'inline',
+        'SLACK_QUEUE_PATH': os.path.join(WORKDIR, 'queue.db'),
+        'MAPPING_BACKEND': 'sqlite',
+        'MAPPING_SQLITE_PATH': os.path.join(WORKDIR, 'messages.db'),
+        'LOG_FILE': os.path.join(WORKDIR, 'app.log'),
+        'LOG_LEVEL': 'WARNING',
+        'LOG_TO_STDOUT': '0',
+        'HTTP_LOG_PATH': os.path.join(WORKDIR, 'http_requests.log'),
+    }
+    env.update({key: str(value) for key, value in overrides.items()})
+    os.environ.update(env)
+
+
+def import_bots():
+    """Import slack_bot and discord_bot without reaching Slack.
+
+    slack_bot asks auth.test for the bot's user id at import time; that one call
+    is answered locally. Every other Slack or Discord call is up to the script.
+    """
+    from unittest import mock
+    from slack_sdk import WebClient
+
+    with mock.patch.object(WebClient, 'api_call', return_value={'user_id': BOT_ID}):
+        import slack_bot
+        import discord_bot
+    return slack_bot, discord_bot
+
+
+def unthrottle(dispatcher):
+    """Lift the API rate limits of the outbound dispatcher, so the benchmark measures the relay itself."""
+    dispatcher.limits = {route: (1e9, 1e9, per_channel) for route, (_, _, per_channel) in dispatcher.limits.items()}
+
+
+def rss_mb():
+    """Resident set size of this process in MiB."""
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # Без /proc доступен только пик (в КиБ на Linux, в байтах на macOS)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def fd_count():
+    """Open file descriptors of this process, or None where /proc and /dev/fd are missing."""
+    for path in ('/proc/self/fd', '/dev/fd'):
+        try:
+            return len(os.listdir(path))
+        except OSError:
+            continue
+    return None
+
+
+def report(title, rows):
+    """Print (name, value) rows as an aligned table."""
+    print(title)
+    width = max(len(name) for name, _ in rows)
+    for name, value in rows:
+        print(f'  {name:<{width}}  {value}')
@@ -0,0 +1,148 @@
+"""Load test of the Slack webhook under Flask and under the ASGI server.
+
+Each server is started on a free local port with SLACK_EVENTS_MODE=queue, so a
+request is what Slack waits on: signature check, parse, event_id dedup and the
+durable queue insert (the queue workers are not started). An aiohttp client
+sends --requests signed message events, --concurrency at a time.
+
+A heartbeat task runs on the loop standing in for the Discord client's: the
+uvicorn loop for ASGI, a separate idle loop for Flask. Its worst delay is how
+long gateway events would have waited while the webhook was under load.
+
+    python bench/load_webhook.py --requests 5000 --concurrency 50
+"""
+from werkzeug.serving import make_server
+import statistics
+import threading
+import argparse
+import asyncio
+import socket
+import json
+import time
+import harness
+
+harness.configure(SLACK_EVENTS_MODE='queue', HTTP_LOG_SAMPLE_RATE=1.0)
+harness.import_bots()
+from slack_sdk.signature import SignatureVerifier
+import aiohttp
+import uvicorn
+import main as flask_main
+import asgi
+
+signer = SignatureVerifier(harness.SIGNING_SECRET)
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+def signed_request(i):
+    body = json.dumps({
+        'type': 'event_callback',
+        'event_id': f'Ev{time.time_ns()}{i}',
+        'event': {'type': 'message', 'user': 'UBENCHUSER', 'channel': harness.SLACK_CHANNEL,
+                  'text': f'load message {i}', 'ts': f'{1700000000 + i}.000100'},
+    }).encode()
+    timestamp = str(int(time.time()))
+    headers = {
+        'Content-Type': 'application/json',
+        'X-Slack-Request-Timestamp': timestamp,
+        'X-Slack-Signature': signer.generate_signature(timestamp=timestamp, body=body),
+    }
+    return body, headers
+
+
+class Heartbeat:
+    """Measures how late a loop runs a task that wakes every `interval` seconds."""
+
+    def __init__(self, loop, interval=0.005):
+        self.loop = loop
+        self.interval = interval
+        self.lags = []
+        self.running = True
+        asyncio.run_coroutine_threadsafe(self._beat(), loop)
+
+    async def _beat(self):
+        while self.running:
+            expected = self.loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.lags.append(self.loop.time() - expected)
+
+    def reset(self):
+        self.lags = []
+
+
+def start_loop():
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return loop
+
+
+def start_flask(port):
+    server = make_server('127.0.0.1', port, flask_main.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return Heartbeat(start_loop()), server.shutdown
+
+
+def start_asgi(port):
+    server = uvicorn.Server(uvicorn.Config(asgi.app, host='127.0.0.1', port=port, lifespan='off', log_level='warning'))
+    loop = start_loop()
+    asyncio.run_coroutine_threadsafe(server.serve(), loop)
+    while not server.started:
+        time.sleep(0.05)
+    return Heartbeat(loop), lambda: setattr(server, 'should_exit', True)
+
+
+async def load(url, total, concurrency):
+    latencies, statuses = [], {}
+    numbers = iter(range(total))
+
+    async def client(session):
+        for i in numbers:
+            body, headers = signed_request(i)
+            started = time.perf_counter()
+            async with session.post(url, data=body, headers=headers) as response:
+                await response.read()
+            latencies.append(time.perf_counter() - started)
+            statuses[response.status] = statuses.get(response.status, 0) + 1
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        started = time.perf_counter()
+        await asyncio.gather(*(client(session) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    return elapsed, sorted(latencies), statuses
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--server', choices=('flask', 'asgi', 'both'), default='both')
+    args = parser.parse_args()
+
+    rows = []
+    for name, start in (('flask', start_flask), ('asgi', start_asgi)):
+        if args.server not in (name, 'both'):
+            continue
+        port = free_port()
+        heartbeat, stop = start(port)
+        url = f'http://127.0.0.1:{port}/slack/events'
+        # Прогрев: соединения, импорты и первые записи в очередь
+        asyncio.run(load(url, min(200, args.requests), args.concurrency))
+        heartbeat.reset()
+
+        elapsed, latencies, statuses = asyncio.run(load(url, args.requests, args.concurrency))
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        rows.append((name, f'{args.requests / elapsed:7.0f} req/s   p50 {statistics.median(latencies) * 1e3:6.1f} ms   '
+                           f'p99 {p99 * 1e3:6.1f} ms   loop stalled up to {max(heartbeat.lags) * 1e3:6.1f} ms   {statuses}'))
+        heartbeat.running = False
+        stop()
+
+    harness.report(f'{args.requests} signed events, {args.concurrency} concurrent clients, SLACK_EVENTS_MODE=queue', rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+"""Soak test of the Slack -> Discord path: handle_event -> run_on_discord_loop -> route_event.
+
+Worker threads feed synthetic Slack message events through slack_bot.handle_event,
+exactly as the queue workers do, onto one long-lived loop standing in for the
+Discord client's. Discord is a stub that answers sends immediately; the mapping
+store is a throwaway SQLite file with write-behind on. Every fifth event replies
+in the thread of the first message of its block of 50, so threads are opened
+once and then reused.
+
+At each checkpoint the script prints RSS, open file descriptors, threads and the
+tasks alive on the loop. With one loop for all events they stay flat; a loop or
+selector per event shows up as FDs and RSS growing with the event count.
+
+    python bench/soak_events.py --events 100000 --workers 4
+"""
+from concurrent.futures import ThreadPoolExecutor
+import itertools
+import threading
+import argparse
+import asyncio
+import time
+import harness
+
+harness.configure()
+slack_bot, discord_bot = harness.import_bots()
+from dispatcher import outbound
+import db
+
+_ids = itertools.count(10_000)
+
+
+class StubMessage:
+    def __init__(self, channel, content):
+        self.id = next(_ids)
+        self.channel = channel
+        self.content = content
+        self.thread = None
+
+    async def create_thread(self, name):
+        self.thread = self.channel.guild.open_thread(name)
+        return self.thread
+
+
+class StubChannel:
+    def __init__(self, channel_id, guild):
+        self.id = channel_id
+        self.guild = guild
+        self.messages = {}
+        self.sent = 0
+
+    async def send(self, text, files=None):
+        self.sent += 1
+        message = StubMessage(self, text)
+        # Только последние сообщения: ответы ссылаются на недавние
+        if len(self.messages) >= 1000:
+            self.messages.pop(next(iter(self.messages)))
+        self.messages[message.id] = message
+        return message
+
+    async def fetch_message(self, message_id):
+        return self.messages[message_id]
+
+
+class StubGuild:
+    def __init__(self):
+        self.id = 1
+        self.threads = {}
+
+    def open_thread(self, name):
+        thread = StubChannel(next(_ids), self)
+        self.threads[thread.id] = thread
+        return thread
+
+    def get_thread(self, thread_id):
+        return self.threads.get(thread_id)
+
+
+def make_event(i):
+    ts = f'{1700000000 + i}.000100'
+    event = {
+        'type': 'message',
+        'user': 'UBENCHUSER',
+        'channel': harness.SLACK_CHANNEL,
+        'text': f'soak message {i}',
+        'ts': ts,
+    }
+    if i % 5 == 4:
+        event['thread_ts'] = f'{1700000000 + i - i % 50}.000100'
+    return {'event_id': f'Ev{i}', 'event': event}
+
+
+def loop_stats(loop):
+    async def count():
+        return len(asyncio.all_tasks())
+    return asyncio.run_coroutine_threadsafe(count(), loop).result()
+
+
+def stop_loop(loop):
+    async def cancel_all():
+        for task in asyncio.all_tasks():
+            if task is not asyncio.current_task():
+                task.cancel()
+    asyncio.run_coroutine_threadsafe(cancel_all(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--events', type=int, default=100_000)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--checkpoints', type=int, default=10)
+    args = parser.parse_args()
+
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name='discord-loop', daemon=True).start()
+
+    guild = StubGuild()
+    channel = StubChannel(harness.DISCORD_CHANNEL, guild)
+    discord_bot.discord_client.loop = loop
+    discord_bot.discord_client.get_channel = lambda channel_id: channel if channel_id == channel.id else None
+    slack_bot.user_directory.update({'id': 'UBENCHUSER', 'real_name': 'Soak', 'profile': {'display_name': 'soak'}})
+    slack_bot.channel_directory.cache.set(harness.SLACK_CHANNEL, 'bench')
+    db.ensure_indexes()
+    harness.unthrottle(outbound)
+
+    step = max(1, args.events // args.checkpoints)
+    started = time.perf_counter()
+    failed = 0
+    print(f'{"events":>8} {"ev/s":>8} {"rss MiB":>8} {"fds":>5} {"threads":>7} {"tasks":>5} {"threads opened":>14}')
+    print(f'{0:>8} {"-":>8} {harness.rss_mb():>8.1f} {harness.fd_count()!s:>5} {threading.active_count():>7} {loop_stats(loop):>5} {0:>14}')
+
+    with ThreadPoolExecutor(args.workers, thread_name_prefix='slack-worker') as workers:
+        for start in range(0, args.events, step):
+            batch_started = time.perf_counter()
+            results = workers.map(lambda i: slack_bot.handle_event(make_event(i)), range(start, min(start + step, args.events)))
+            try:
+                for _ in results:
+                    pass
+            except Exception as e:
+                failed += 1
+                print(f'  event failed: {e!r}')
+            done = min(start + step, args.events)
+            rate = (done - start) / (time.perf_counter() - batch_started)
+            print(f'{done:>8} {rate:>8.0f} {harness.rss_mb():>8.1f} {harness.fd_count()!s:>5} '
+                  f'{threading.active_count():>7} {loop_stats(loop):>5} {len(guild.threads):>14}')
+
+    elapsed = time.perf_counter() - started
+    db.shutdown()
+    harness.report('summary', [
+        ('events', args.events),
+        ('seconds', f'{elapsed:.1f}'),
+        ('events/s', f'{args.events / elapsed:.0f}'),
+        ('discord sends', channel.sent + sum(thread.sent for thread in guild.threads.values())),
+        ('failed batches', failed),
+        ('dispatcher', outbound.stats()),
+    ])
+    stop_loop(loop)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+from pymongo.errors import DuplicateKeyError
+import threading
+import asyncio
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire `ttl` seconds after being set.
+
+    `ttl=None` keeps entries until they are evicted by size.
+    """
+
+    def __init__(self, maxsize, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (value, время истечения)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+
+            value, expires_at = item
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._data.pop(key, None)
+            return item[0] if item is not None else default
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else None,
+            }
+
+
+class ExpiringSet:
+    """Thread-safe set whose members expire `ttl` seconds after being added.
+
+    Every member lives for the same `ttl`, so a deque in insertion order is also in
+    expiry order: add, membership and expiry are all amortised O(1). With `maxsize`
+    the oldest members are dropped first. When a Mongo collection is given, members
+    are also written there (a TTL index removes them), so restarts and other
+    instances see the same set; use add_async on an event loop, since pymongo blocks.
+    """
+
+    def __init__(self, ttl, maxsize=None, collection=None):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.collection = collection
+        self._expiry = deque()  # (время истечения, key) в порядке добавления
+        self._members = {}      # key -> время истечения
+        self._lock = threading.Lock()
+
+        if collection is not None:
+            collection.create_index('created_at', expireAfterSeconds=ttl)
+
+    def add(self, key):
+        """Add `key`; returns False if it is already a member."""
+        if not self._add_local(key):
+            return False
+        if self.collection is not None:
+            return self._add_to_collection(key)
+        return True
+
+    async def add_async(self, key):
+        """Same as add, but the shared store is written from a worker thread."""
+        if not self._add_local(key):
+            return False
+        if self.collection is not None:
+            return await asyncio.to_thread(self._add_to_collection, key)
+        return True
+
+    def discard(self, key):
+        """Forget `key`, so that a later add of it succeeds again."""
+        with self._lock:
+            self._members.pop(key, None)
+        if self.collection is not None:
+            try:
+                self.collection.delete_one({"_id": key})
+            except Exception as e:
+                logger.error('Expiring set store error for %s: %s', key, e)
+
+    def __contains__(self, key):
+        with self._lock:
+            self._expire(time.monotonic())
+            return key in self._members
+
+    def __len__(self):
+        with self._lock:
+            self._expire(time.monotonic())
+            return len(self._members)
+
+    def _add_local(self, key):
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            if key in self._members:
+                return False
+            expires_at = now + self.ttl
+            self._members[key] = expires_at
+            self._expiry.append((expires_at, key))
+            if self.maxsize is not None:
+                while len(self._members) > self.maxsize:
+                    self._drop_oldest()
+            return True
+
+    def _expire(self, now):
+        while self._expiry and self._expiry[0][0] <= now:
+            self._drop_oldest()
+
+    def _drop_oldest(self):
+        # Записи, удалённые через discard или добавленные заново, в очереди устарели
+        expires_at, key = self._expiry.popleft()
+        if self._members.get(key) == expires_at:
+            del self._members[key]
+
+    def _add_to_collection(self, key):
+        try:
+            self.collection.insert_one({"_id": key, "created_at": datetime.now(timezone.utc)})
+            return True
+        except DuplicateKeyError:
+            return False
+        except Exception as e:
+            # Shared store unavailable: fall back to the in-memory view
+            logger.error('Expiring set store error for %s: %s', key, e)
+            return True
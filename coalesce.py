@@ -0,0 +1,125 @@
+import asyncio
+import logging
+import config
+
+logger = logging.getLogger(__name__)
+
+# Discord and Slack both take one message of up to 2000 characters
+MAX_MESSAGE_LENGTH = 2000
+
+
+class Burst:
+    def __init__(self, author, header, deliver, future):
+        self.author = author
+        self.deliver = deliver
+        self.future = future
+        self.parts = [header]
+        self.source_ids = []
+        self.length = len(header)
+        self.timer = None
+        self.waiters = 0
+
+    def text(self):
+        return '\n'.join(self.parts)
+
+
+class Coalescer:
+    """Merges consecutive messages from one author in one channel into a single send.
+
+    The first message of a burst opens a `window`-second timer; messages from the
+    same author in the same channel that arrive before it fires are appended to
+    the burst. A message from someone else, or one that would take the burst past
+    `max_length`, sends the pending burst right away, so channel order is kept.
+    Callers of submit await the one delivery of their burst and get its result;
+    callers of add return at once and leave delivery errors to be logged here.
+    """
+
+    def __init__(self, window, max_length=MAX_MESSAGE_LENGTH):
+        self.window = window
+        self.max_length = max_length
+        self._bursts = {}   # channel -> Burst
+        self._sources = {}  # source message id -> channel of its pending burst
+        self._tasks = set()
+
+    def accepts(self, header, body):
+        """Whether a message may be coalesced at all (coalescing is on and it fits in one send)."""
+        return self.window > 0 and len(header) + 1 + len(body) < self.max_length
+
+    async def submit(self, channel, author, header, body, source_id, deliver):
+        """Add a message to the burst for `channel` and return the result of its delivery."""
+        burst = self.add(channel, author, header, body, source_id, deliver)
+        burst.waiters += 1
+        return await asyncio.shield(burst.future)
+
+    def add(self, channel, author, header, body, source_id, deliver):
+        """Add a message to the burst for `channel` without waiting for the window; returns the burst.
+
+        `deliver(text, source_ids)` is a coroutine function that sends the merged
+        text and records a mapping for each source id; the burst is sent with the
+        `deliver` and `header` of its first message. Must be called on the loop.
+        """
+        loop = asyncio.get_running_loop()
+        burst = self._bursts.get(channel)
+        if burst and (burst.author != author or burst.length + 1 + len(body) >= self.max_length):
+            self.flush_channel(channel)
+            burst = None
+
+        if burst is None:
+            burst = self._bursts[channel] = Burst(author, header, deliver, loop.create_future())
+            burst.timer = loop.call_later(self.window, self.flush_channel, channel)
+
+        burst.parts.append(body)
+        burst.length += 1 + len(body)
+        burst.source_ids.append(source_id)
+        self._sources[source_id] = channel
+        return burst
+
+    def flush_channel(self, channel):
+        """Start sending the pending burst for `channel`, if any, and return its future."""
+        burst = self._bursts.pop(channel, None)
+        if burst is None:
+            return None
+        burst.timer.cancel()
+        for source_id in burst.source_ids:
+            self._sources.pop(source_id, None)
+
+        task = asyncio.create_task(self._deliver(channel, burst))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return burst.future
+
+    async def drain_channel(self, channel):
+        """Send the pending burst for `channel` now and wait until it has been delivered.
+
+        Awaited before a message that bypasses coalescing (e.g. one with files) goes
+        to the same channel, so it cannot overtake the burst.
+        """
+        future = self.flush_channel(channel)
+        if future is not None:
+            # The burst's own callers report delivery errors; the bypassing message just goes on
+            await asyncio.gather(asyncio.shield(future), return_exceptions=True)
+
+    async def flush_source(self, source_id):
+        """Send the pending burst holding `source_id` now and wait until its mappings exist.
+
+        Used before resolving a reply, whose parent may still be waiting in a burst.
+        """
+        channel = self._sources.get(source_id)
+        if channel is not None:
+            await self.drain_channel(channel)
+
+    async def _deliver(self, channel, burst):
+        try:
+            result = await burst.deliver(burst.text(), burst.source_ids)
+        except Exception as e:
+            if not burst.waiters:
+                # Никто не ждёт эту пачку, так что сообщаем об ошибке здесь
+                logger.error('Delivery of %d coalesced messages to %s failed: %r', len(burst.source_ids), channel, e)
+            burst.future.set_exception(e)
+            # Retrieved here, so an unawaited failure is not reported again at garbage collection
+            burst.future.exception()
+        else:
+            burst.future.set_result(result)
+
+
+coalescer = Coalescer(config.COALESCE_WINDOW)
@@ -37,3 +37,118 @@ DISCORD_CHANNELS_DICT = {
     DISCORD_CHANNEL_MADE_IN_HACKLAB:SLACK_CHANNEL_MADE_IN_HACKLAB,
     DISCORD_CHANNEL_TEST:SLACK_CHANNEL_TEST
     }
+
+# Slack event ingestion: 'queue' acknowledges right away and relays from a durable queue,
+# 'inline' relays inside the HTTP request
+SLACK_EVENTS_MODE = os.environ.get('SLACK_EVENTS_MODE', 'queue')
+SLACK_QUEUE_PATH = os.environ.get('SLACK_QUEUE_PATH', 'slack_events_queue.db')
+SLACK_QUEUE_WORKERS = int(os.environ.get('SLACK_QUEUE_WORKERS', 4))
+SLACK_QUEUE_MAX_ATTEMPTS = int(os.environ.get('SLACK_QUEUE_MAX_ATTEMPTS', 3))
+# Backoff before a failed event is retried: doubles from RETRY_DELAY up to RETRY_MAX_DELAY seconds
+SLACK_QUEUE_RETRY_DELAY = float(os.environ.get('SLACK_QUEUE_RETRY_DELAY', 10))
+SLACK_QUEUE_RETRY_MAX_DELAY = float(os.environ.get('SLACK_QUEUE_RETRY_MAX_DELAY', 600))
+
+# Idempotent ingestion: Slack event IDs remembered to drop retried deliveries
+# ('memory' or 'mongo' to share them between restarts and instances)
+EVENT_DEDUP_BACKEND = os.environ.get('EVENT_DEDUP_BACKEND', 'memory')
+EVENT_DEDUP_TTL = int(os.environ.get('EVENT_DEDUP_TTL', 3600))
+EVENT_DEDUP_MAX_SIZE = int(os.environ.get('EVENT_DEDUP_MAX_SIZE', 10000))
+
+# Slack user directory cache
+USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 3600))
+USER_CACHE_MAX_SIZE = int(os.environ.get('USER_CACHE_MAX_SIZE', 5000))
+
+# Slack channel metadata cache
+CHANNEL_CACHE_TTL = int(os.environ.get('CHANNEL_CACHE_TTL', 86400))
+CHANNEL_CACHE_MAX_SIZE = int(os.environ.get('CHANNEL_CACHE_MAX_SIZE', 500))
+
+# Resolution of the Slack message ts for files uploaded from Discord
+FILE_SHARE_TIMEOUT = float(os.environ.get('FILE_SHARE_TIMEOUT', 30))
+FILE_SHARE_POLL_INITIAL_DELAY = float(os.environ.get('FILE_SHARE_POLL_INITIAL_DELAY', 0.5))
+FILE_SHARE_POLL_MAX_DELAY = float(os.environ.get('FILE_SHARE_POLL_MAX_DELAY', 8))
+
+# Shared HTTP session used for attachment transfers and the async Slack client
+HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', 50))
+HTTP_POOL_PER_HOST = int(os.environ.get('HTTP_POOL_PER_HOST', 10))
+HTTP_DNS_CACHE_TTL = int(os.environ.get('HTTP_DNS_CACHE_TTL', 300))
+HTTP_KEEPALIVE_TIMEOUT = float(os.environ.get('HTTP_KEEPALIVE_TIMEOUT', 30))
+
+# Attachment downloads: concurrent files per message, per process, and per-file timeout (seconds)
+DOWNLOAD_CONCURRENCY_PER_MESSAGE = int(os.environ.get('DOWNLOAD_CONCURRENCY_PER_MESSAGE', 4))
+DOWNLOAD_CONCURRENCY = int(os.environ.get('DOWNLOAD_CONCURRENCY', 16))
+DOWNLOAD_TIMEOUT = float(os.environ.get('DOWNLOAD_TIMEOUT', 30))
+
+# Attachments are relayed through in-memory buffers that spill to a temporary file above this size (bytes)
+ATTACHMENT_SPOOL_THRESHOLD = int(os.environ.get('ATTACHMENT_SPOOL_THRESHOLD', 8 * 1024 * 1024))
+ATTACHMENT_CHUNK_SIZE = int(os.environ.get('ATTACHMENT_CHUNK_SIZE', 64 * 1024))
+
+# Message-ID mapping store: 'mongo' or the embedded 'sqlite' file,
+# LRU cache size per lookup direction, optional retention in days
+MAPPING_BACKEND = os.environ.get('MAPPING_BACKEND', 'mongo')
+MAPPING_SQLITE_PATH = os.environ.get('MAPPING_SQLITE_PATH', 'messages.db')
+MAPPING_CACHE_SIZE = int(os.environ.get('MAPPING_CACHE_SIZE', 10000))
+MAPPING_RETENTION_DAYS = int(os.environ.get('MAPPING_RETENTION_DAYS', 0))
+
+# MongoDB connection pool settings, applied to both the sync and the async client
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', 50))
+MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', 0))
+MONGO_MAX_IDLE_TIME_MS = int(os.environ.get('MONGO_MAX_IDLE_TIME_MS', 60000))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000))
+
+# Write-behind batching of mapping inserts: flush by batch size or every N seconds
+MAPPING_WRITE_BEHIND = os.environ.get('MAPPING_WRITE_BEHIND', '1') == '1'
+MAPPING_BATCH_SIZE = int(os.environ.get('MAPPING_BATCH_SIZE', 100))
+MAPPING_FLUSH_INTERVAL = float(os.environ.get('MAPPING_FLUSH_INTERVAL', 1.0))
+
+# Upper bound (seconds) on relaying one Slack event on the Discord loop
+SLACK_EVENT_TIMEOUT = float(os.environ.get('SLACK_EVENT_TIMEOUT', 120))
+
+# Web server for the Slack webhook: 'flask' (development server in a thread) or
+# 'asgi' (uvicorn on the Discord client's event loop)
+WEB_SERVER = os.environ.get('WEB_SERVER', 'flask')
+WEB_HOST = os.environ.get('WEB_HOST', '0.0.0.0')
+WEB_PORT = int(os.environ.get('WEB_PORT', 5000))
+WEB_KEEP_ALIVE_TIMEOUT = int(os.environ.get('WEB_KEEP_ALIVE_TIMEOUT', 75))
+
+# Outbound dispatcher: retries of a send after a 429 (honouring Retry-After)
+OUTBOUND_MAX_RETRIES = int(os.environ.get('OUTBOUND_MAX_RETRIES', 3))
+
+# Burst coalescing: consecutive messages from one author in one channel within
+# this many seconds are relayed as a single message (0 disables it)
+COALESCE_WINDOW = float(os.environ.get('COALESCE_WINDOW', 0))
+
+# Discord thread id -> Slack thread_ts, for Discord thread replies (LRU)
+THREAD_CACHE_MAX_SIZE = int(os.environ.get('THREAD_CACHE_MAX_SIZE', 10000))
+
+# File dedup for Slack file_share events: how long file IDs are remembered and
+# where ('memory', or 'mongo' to share them across restarts and instances)
+FILE_DEDUP_TTL = int(os.environ.get('FILE_DEDUP_TTL', 300))
+FILE_DEDUP_BACKEND = os.environ.get('FILE_DEDUP_BACKEND', 'memory')
+
+# HTTP audit log of the Flask webhook: one JSON line per request/response pair,
+# rotated by size ('size') or time ('time'); errors are always logged, other
+# requests with probability HTTP_LOG_SAMPLE_RATE
+HTTP_LOG_PATH = os.environ.get('HTTP_LOG_PATH', 'http_requests.log')
+HTTP_LOG_ROTATION = os.environ.get('HTTP_LOG_ROTATION', 'size')
+HTTP_LOG_MAX_BYTES = int(os.environ.get('HTTP_LOG_MAX_BYTES', 10 * 1024 * 1024))
+HTTP_LOG_ROTATE_WHEN = os.environ.get('HTTP_LOG_ROTATE_WHEN', 'midnight')
+HTTP_LOG_BACKUP_COUNT = int(os.environ.get('HTTP_LOG_BACKUP_COUNT', 5))
+HTTP_LOG_SAMPLE_RATE = float(os.environ.get('HTTP_LOG_SAMPLE_RATE', 1.0))
+HTTP_LOG_REDACT_HEADERS = os.environ.get('HTTP_LOG_REDACT_HEADERS', 'Authorization,Cookie,Set-Cookie,X-Slack-Signature').split(',')
+
+# Logging: app.log (and stdout unless LOG_TO_STDOUT=0), root level and
+# per-module levels as "module=LEVEL,module=LEVEL"
+LOG_FILE = os.environ.get('LOG_FILE', 'app.log')
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_LEVELS = dict(
+    (name.strip(), level.strip().upper())
+    for name, level in (item.split('=') for item in os.environ.get('LOG_LEVELS', '').split(',') if item.strip())
+)
+LOG_TO_STDOUT = os.environ.get('LOG_TO_STDOUT', '1') == '1'
+
+# Tracing of relayed messages: 'none', 'jsonl' (spans appended to TRACE_FILE)
+# or 'otlp' (OTLP/HTTP JSON to TRACE_OTLP_ENDPOINT)
+TRACE_EXPORTER = os.environ.get('TRACE_EXPORTER', 'none')
+TRACE_FILE = os.environ.get('TRACE_FILE', 'traces.jsonl')
+TRACE_OTLP_ENDPOINT = os.environ.get('TRACE_OTLP_ENDPOINT', 'http://localhost:4318/v1/traces')
+TRACE_SERVICE_NAME = os.environ.get('TRACE_SERVICE_NAME', 'discord-slack-bot')
@@ -1,27 +1,242 @@
 from pymongo import MongoClient
+from pymongo.errors import OperationFailure
 from config import MONGO_DB
+from cache import TTLCache
+from db_backends import MongoBackend, SQLiteBackend
+import config
+import metrics
+import sqlite3
+import threading
+import atexit
 import logging
 
+logger = logging.getLogger(__name__)
+
 # MongoDB configuration
-mongo_client = MongoClient(MONGO_DB)  
-db = mongo_client['HACKLAB']
-messages_collection = db['Slack-Discord messages']
+MONGO_POOL_OPTIONS = {
+    "maxPoolSize": config.MONGO_MAX_POOL_SIZE,
+    "minPoolSize": config.MONGO_MIN_POOL_SIZE,
+    "maxIdleTimeMS": config.MONGO_MAX_IDLE_TIME_MS,
+    "serverSelectionTimeoutMS": config.MONGO_SERVER_SELECTION_TIMEOUT_MS,
+}
+
+# Хранилище соответствий Slack <-> Discord выбирается в config.MAPPING_BACKEND
+if config.MAPPING_BACKEND == 'sqlite':
+    backend = SQLiteBackend(config.MAPPING_SQLITE_PATH)
+else:
+    backend = MongoBackend(MONGO_DB, MONGO_POOL_OPTIONS)
+
+_mongo_database = None
+
+# LRU caches in front of both lookup directions
+discord_ids_cache = TTLCache(config.MAPPING_CACHE_SIZE)  # slack_message_id -> discord_message_id
+slack_ids_cache = TTLCache(config.MAPPING_CACHE_SIZE)    # discord_message_id -> slack_message_id
+thread_ids_cache = TTLCache(config.MAPPING_CACHE_SIZE)   # discord_message_id -> discord_thread_id
+
+# Write-behind buffer: mappings saved but not yet written to the backend.
+# Lookups read through it, so a reply that arrives before the flush still resolves.
+pending_mappings = []     # (slack_message_id, discord_message_id) in save order
+pending_discord_ids = {}  # slack_message_id -> discord_message_id
+pending_slack_ids = {}    # discord_message_id -> slack_message_id
+_pending_cond = threading.Condition()
+_flush_lock = threading.Lock()
+_writer_stop = threading.Event()
+_writer = None
+
+def get_mongo_database():
+    """The 'HACKLAB' database, for stores other than the mapping that live in Mongo."""
+    global _mongo_database
+    if isinstance(backend, MongoBackend):
+        return backend.database
+    if _mongo_database is None:
+        _mongo_database = MongoClient(MONGO_DB, **MONGO_POOL_OPTIONS)['HACKLAB']
+    return _mongo_database
+
+def ensure_indexes():
+    """Create the mapping indexes; called once at startup."""
+    try:
+        backend.ensure_indexes(config.MAPPING_RETENTION_DAYS)
+        logger.info('Mapping indexes are in place')
+    except (OperationFailure, sqlite3.IntegrityError) as e:
+        # Например, в коллекции уже есть дубликаты пар slack/discord
+        logger.error('Could not create mapping indexes: %s', e)
+
+async def close_async_client():
+    await backend.close_async()
+
+def remember_mapping(slack_message_id, discord_message_id):
+    # A coalesced message maps to several messages on the other side; in both directions
+    # the first one stays its counterpart, as in the store's ordered lookups
+    if discord_ids_cache.get(slack_message_id) is None:
+        discord_ids_cache.set(slack_message_id, discord_message_id)
+    if slack_ids_cache.get(discord_message_id) is None:
+        slack_ids_cache.set(discord_message_id, slack_message_id)
+
+def buffer_mapping(slack_message_id, discord_message_id):
+    global _writer
+    with _pending_cond:
+        pending_mappings.append((slack_message_id, discord_message_id))
+        pending_discord_ids.setdefault(slack_message_id, discord_message_id)
+        pending_slack_ids.setdefault(discord_message_id, slack_message_id)
+        if _writer is None:
+            _writer = threading.Thread(target=write_behind_loop, name='mapping-writer', daemon=True)
+            _writer.start()
+        if len(pending_mappings) >= config.MAPPING_BATCH_SIZE:
+            _pending_cond.notify()
+    remember_mapping(slack_message_id, discord_message_id)
+
+def cached_discord_message_id(slack_message_id):
+    """Counterpart known without a store lookup: cached, or saved but not flushed yet."""
+    return discord_ids_cache.get(slack_message_id) or pending_discord_ids.get(slack_message_id)
+
+def cached_slack_message_id(discord_message_id):
+    return slack_ids_cache.get(discord_message_id) or pending_slack_ids.get(discord_message_id)
+
+def found_discord_message_id(slack_message_id, discord_message_id):
+    """Cache the result of a store lookup; a miss raises KeyError."""
+    if discord_message_id is None:
+        logger.debug("Discord message ID not found for this Slack message ID")
+        raise KeyError("Discord message ID not found for this Slack message ID")
+    discord_ids_cache.set(slack_message_id, discord_message_id)
+    return discord_message_id
+
+def found_slack_message_id(discord_message_id, slack_message_id):
+    """Cache the result of a store lookup; a miss is returned as None."""
+    if slack_message_id is not None:
+        slack_ids_cache.set(discord_message_id, slack_message_id)
+    return slack_message_id
+
+def saved_mapping(slack_message_id, discord_message_id, inserted):
+    """Bookkeeping after a direct (not write-behind) insert."""
+    if not inserted:
+        logger.debug('Mapping for Slack message %s already exists', slack_message_id)
+        return
+    logger.debug('Message saved to database: %s : %s', slack_message_id, discord_message_id)
+    remember_mapping(slack_message_id, discord_message_id)
+
+def write_behind_loop():
+    while not _writer_stop.is_set():
+        with _pending_cond:
+            _pending_cond.wait_for(
+                lambda: len(pending_mappings) >= config.MAPPING_BATCH_SIZE or _writer_stop.is_set(),
+                timeout=config.MAPPING_FLUSH_INTERVAL
+            )
+        flush()
+
+def flush():
+    """Write all buffered mappings with one batch insert."""
+    with _flush_lock:
+        with _pending_cond:
+            batch = list(pending_mappings)
+        if not batch:
+            return
+
+        try:
+            # Batches mix mappings of both directions
+            with metrics.stage('mapping_flush', direction='both'):
+                inserted = backend.insert_many(batch)
+        except Exception as e:
+            # Записи остаются в буфере и будут записаны при следующей попытке
+            logger.error('Mapping flush failed, %d mappings kept for retry: %s', len(batch), e)
+            return
+
+        with _pending_cond:
+            # New mappings are only appended, so the batch is still the head of the list
+            del pending_mappings[:len(batch)]
+            for slack_message_id, discord_message_id in batch:
+                if pending_discord_ids.get(slack_message_id) == discord_message_id:
+                    del pending_discord_ids[slack_message_id]
+                if pending_slack_ids.get(discord_message_id) == slack_message_id:
+                    del pending_slack_ids[discord_message_id]
+        logger.info('Mappings flushed to database: %d written, %d already existed', inserted, len(batch) - inserted)
+
+def shutdown():
+    """Stop the write-behind thread and flush whatever is still pending."""
+    _writer_stop.set()
+    with _pending_cond:
+        _pending_cond.notify()
+    flush()
+
+atexit.register(shutdown)
+
+# ----------- Async API (Discord loop) -----------
+
+async def save_message_to_db_async(slack_message_id, discord_message_id):
+    if config.MAPPING_WRITE_BEHIND:
+        buffer_mapping(slack_message_id, discord_message_id)
+        return
+
+    with metrics.stage('mapping_save'):
+        inserted = await backend.insert_async(slack_message_id, discord_message_id)
+    saved_mapping(slack_message_id, discord_message_id, inserted)
+
+async def get_discord_message_id_async(slack_message_id):
+    discord_message_id = cached_discord_message_id(slack_message_id)
+    if discord_message_id is not None:
+        return discord_message_id
+
+    with metrics.stage('mapping_lookup'):
+        discord_message_id = await backend.find_discord_message_id_async(slack_message_id)
+    return found_discord_message_id(slack_message_id, discord_message_id)
+
+async def get_slack_message_id_async(discord_message_id):
+    """Reverse lookup; returns None when the Discord message was never relayed."""
+    slack_message_id = cached_slack_message_id(discord_message_id)
+    if slack_message_id is not None:
+        return slack_message_id
+
+    with metrics.stage('mapping_lookup'):
+        slack_message_id = await backend.find_slack_message_id_async(discord_message_id)
+    return found_slack_message_id(discord_message_id, slack_message_id)
+
+async def save_thread_id_async(discord_message_id, discord_thread_id):
+    """Remember the thread opened under a relayed Discord message."""
+    await backend.save_thread_id_async(discord_message_id, discord_thread_id)
+    thread_ids_cache.set(discord_message_id, discord_thread_id)
+
+async def get_thread_id_async(discord_message_id):
+    """Thread under the Discord message, or None if none is known yet."""
+    discord_thread_id = thread_ids_cache.get(discord_message_id)
+    if discord_thread_id is not None:
+        return discord_thread_id
+
+    with metrics.stage('mapping_lookup'):
+        discord_thread_id = await backend.find_thread_id_async(discord_message_id)
+    if discord_thread_id is not None:
+        thread_ids_cache.set(discord_message_id, discord_thread_id)
+    return discord_thread_id
+
+async def forget_thread_id_async(discord_message_id):
+    """Drop a thread that no longer exists, so the next reply opens a new one."""
+    thread_ids_cache.pop(discord_message_id)
+    await backend.delete_thread_id_async(discord_message_id)
+
+# ----------- Sync API (Flask threads) -----------
 
 def save_message_to_db(slack_message_id, discord_message_id):
-    messages_collection.insert_one({
-        "slack_message_id": slack_message_id,
-        "discord_message_id": discord_message_id
-    })
-    logger(f'Message saved to database: {slack_message_id:} : {discord_message_id}')
+    if config.MAPPING_WRITE_BEHIND:
+        buffer_mapping(slack_message_id, discord_message_id)
+        return
 
+    with metrics.stage('mapping_save'):
+        inserted = backend.insert(slack_message_id, discord_message_id)
+    saved_mapping(slack_message_id, discord_message_id, inserted)
 
 def get_discord_message_id(slack_message_id):
-    result = messages_collection.find_one({"slack_message_id": slack_message_id})
-    if result:
-        return result['discord_message_id']
-    logger("Discord message ID not found for this Slack message ID")
-    raise KeyError("Discord message ID not found for this Slack message ID")
-
-def logger(log_text):
-    print(log_text)
-    logging.info(log_text)
\ No newline at end of file
+    discord_message_id = cached_discord_message_id(slack_message_id)
+    if discord_message_id is not None:
+        return discord_message_id
+
+    with metrics.stage('mapping_lookup'):
+        discord_message_id = backend.find_discord_message_id(slack_message_id)
+    return found_discord_message_id(slack_message_id, discord_message_id)
+
+def get_slack_message_id(discord_message_id):
+    """Reverse lookup; returns None when the Discord message was never relayed."""
+    slack_message_id = cached_slack_message_id(discord_message_id)
+    if slack_message_id is not None:
+        return slack_message_id
+
+    with metrics.stage('mapping_lookup'):
+        slack_message_id = backend.find_slack_message_id(discord_message_id)
+    return found_slack_message_id(discord_message_id, slack_message_id)
\ No newline at end of file
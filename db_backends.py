@@ -0,0 +1,230 @@
+from pymongo import MongoClient, AsyncMongoClient
+from pymongo.errors import DuplicateKeyError, BulkWriteError
+from datetime import datetime, timezone, timedelta
+import sqlite3
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class MongoBackend:
+    """Mapping store in the remote 'Slack-Discord messages' collection.
+
+    Threads opened under relayed Discord messages are kept in 'Discord threads'.
+    """
+
+    def __init__(self, uri, pool_options):
+        self.uri = uri
+        self.pool_options = pool_options
+        self.client = MongoClient(uri, **pool_options)
+        self.database = self.client['HACKLAB']
+        self.collection = self.database['Slack-Discord messages']
+        self.threads = self.database['Discord threads']
+        # Async client binds to the loop it is first used on, so it is created lazily there
+        self.async_client = None
+
+    def _async_collection(self, name='Slack-Discord messages'):
+        if self.async_client is None:
+            self.async_client = AsyncMongoClient(self.uri, **self.pool_options)
+        return self.async_client['HACKLAB'][name]
+
+    def ensure_indexes(self, retention_days):
+        # A coalesced Slack message maps to several Discord messages, so only the pair is unique
+        if self.collection.index_information().get('slack_message_id_1', {}).get('unique'):
+            self.collection.drop_index('slack_message_id_1')
+        self.collection.create_index([('slack_message_id', 1), ('discord_message_id', 1)], unique=True)
+        self.collection.create_index('discord_message_id')
+        if retention_days:
+            self.collection.create_index('created_at', expireAfterSeconds=retention_days * 24 * 3600)
+            self.threads.create_index('created_at', expireAfterSeconds=retention_days * 24 * 3600)
+
+    @staticmethod
+    def _document(slack_message_id, discord_message_id):
+        return {
+            "slack_message_id": slack_message_id,
+            "discord_message_id": discord_message_id,
+            "created_at": datetime.now(timezone.utc)
+        }
+
+    def insert(self, slack_message_id, discord_message_id):
+        """Store a mapping; returns False if this exact pair is already stored."""
+        try:
+            self.collection.insert_one(self._document(slack_message_id, discord_message_id))
+            return True
+        except DuplicateKeyError:
+            return False
+
+    def insert_many(self, mappings):
+        """Store (slack_message_id, discord_message_id) pairs, skipping ones already stored.
+
+        Returns the number of mappings written.
+        """
+        documents = [self._document(slack_message_id, discord_message_id) for slack_message_id, discord_message_id in mappings]
+        try:
+            return len(self.collection.insert_many(documents, ordered=False).inserted_ids)
+        except BulkWriteError as e:
+            # Остальные документы записаны; дубликаты пропускаем
+            if any(error['code'] != 11000 for error in e.details['writeErrors']):
+                raise
+            return e.details['nInserted']
+
+    def find_discord_message_id(self, slack_message_id):
+        # Several Discord messages may share the Slack message; the first one is its counterpart
+        result = self.collection.find_one({"slack_message_id": slack_message_id}, sort=[('discord_message_id', 1)])
+        return result['discord_message_id'] if result else None
+
+    def find_slack_message_id(self, discord_message_id):
+        # Slack ts values have a fixed width, so the smallest one is the earliest message
+        result = self.collection.find_one({"discord_message_id": discord_message_id}, sort=[('slack_message_id', 1)])
+        return result['slack_message_id'] if result else None
+
+    async def insert_async(self, slack_message_id, discord_message_id):
+        try:
+            await self._async_collection().insert_one(self._document(slack_message_id, discord_message_id))
+            return True
+        except DuplicateKeyError:
+            return False
+
+    async def find_discord_message_id_async(self, slack_message_id):
+        result = await self._async_collection().find_one({"slack_message_id": slack_message_id}, sort=[('discord_message_id', 1)])
+        return result['discord_message_id'] if result else None
+
+    async def find_slack_message_id_async(self, discord_message_id):
+        result = await self._async_collection().find_one({"discord_message_id": discord_message_id}, sort=[('slack_message_id', 1)])
+        return result['slack_message_id'] if result else None
+
+    async def save_thread_id_async(self, discord_message_id, discord_thread_id):
+        await self._async_collection('Discord threads').update_one(
+            {"_id": discord_message_id},
+            {"$set": {"discord_thread_id": discord_thread_id, "created_at": datetime.now(timezone.utc)}},
+            upsert=True
+        )
+
+    async def find_thread_id_async(self, discord_message_id):
+        result = await self._async_collection('Discord threads').find_one({"_id": discord_message_id})
+        return result['discord_thread_id'] if result else None
+
+    async def delete_thread_id_async(self, discord_message_id):
+        await self._async_collection('Discord threads').delete_one({"_id": discord_message_id})
+
+    async def close_async(self):
+        if self.async_client is not None:
+            await self.async_client.close()
+            self.async_client = None
+
+
+class SQLiteBackend:
+    """Embedded mapping store in a local SQLite file (WAL mode).
+
+    Lookups are sub-millisecond local reads, so the async methods call the
+    sync ones directly instead of hopping to a thread.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS messages (
+                slack_message_id TEXT NOT NULL,
+                discord_message_id INTEGER NOT NULL,
+                created_at TEXT NOT NULL
+            )""")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS threads (
+                discord_message_id INTEGER PRIMARY KEY,
+                discord_thread_id INTEGER NOT NULL,
+                created_at TEXT NOT NULL
+            )""")
+
+    def ensure_indexes(self, retention_days):
+        with self._lock:
+            # A coalesced Slack message maps to several Discord messages, so only the pair is unique
+            self._conn.execute('DROP INDEX IF EXISTS messages_slack_id')
+            self._conn.execute(
+                'CREATE UNIQUE INDEX IF NOT EXISTS messages_slack_discord_id ON messages (slack_message_id, discord_message_id)'
+            )
+            self._conn.execute(
+                'CREATE INDEX IF NOT EXISTS messages_discord_id ON messages (discord_message_id)'
+            )
+            if retention_days:
+                # No TTL indexes in SQLite: prune expired mappings at startup instead
+                cutoff = datetime.now(timezone.utc) - timedelta(days=retention_days)
+                deleted = self._conn.execute(
+                    'DELETE FROM messages WHERE created_at < ?', (cutoff.isoformat(),)
+                ).rowcount
+                self._conn.execute('DELETE FROM threads WHERE created_at < ?', (cutoff.isoformat(),))
+                logger.info('Pruned %d expired mappings', deleted)
+
+    def insert(self, slack_message_id, discord_message_id):
+        try:
+            with self._lock:
+                self._conn.execute(
+                    'INSERT INTO messages (slack_message_id, discord_message_id, created_at) VALUES (?, ?, ?)',
+                    (slack_message_id, discord_message_id, datetime.now(timezone.utc).isoformat())
+                )
+            return True
+        except sqlite3.IntegrityError:
+            return False
+
+    def insert_many(self, mappings):
+        created_at = datetime.now(timezone.utc).isoformat()
+        with self._lock:
+            self._conn.execute('BEGIN')
+            try:
+                inserted = self._conn.executemany(
+                    'INSERT OR IGNORE INTO messages (slack_message_id, discord_message_id, created_at) VALUES (?, ?, ?)',
+                    [(slack_message_id, discord_message_id, created_at) for slack_message_id, discord_message_id in mappings]
+                ).rowcount
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+        return inserted
+
+    def find_discord_message_id(self, slack_message_id):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT MIN(discord_message_id) FROM messages WHERE slack_message_id = ?', (slack_message_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def find_slack_message_id(self, discord_message_id):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT MIN(slack_message_id) FROM messages WHERE discord_message_id = ?', (discord_message_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+    async def insert_async(self, slack_message_id, discord_message_id):
+        return self.insert(slack_message_id, discord_message_id)
+
+    async def find_discord_message_id_async(self, slack_message_id):
+        return self.find_discord_message_id(slack_message_id)
+
+    async def find_slack_message_id_async(self, discord_message_id):
+        return self.find_slack_message_id(discord_message_id)
+
+    async def save_thread_id_async(self, discord_message_id, discord_thread_id):
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO threads (discord_message_id, discord_thread_id, created_at) VALUES (?, ?, ?)',
+                (discord_message_id, discord_thread_id, datetime.now(timezone.utc).isoformat())
+            )
+
+    async def find_thread_id_async(self, discord_message_id):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT discord_thread_id FROM threads WHERE discord_message_id = ?', (discord_message_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+    async def delete_thread_id_async(self, discord_message_id):
+        with self._lock:
+            self._conn.execute('DELETE FROM threads WHERE discord_message_id = ?', (discord_message_id,))
+
+    async def close_async(self):
+        pass
@@ -0,0 +1,45 @@
+from cache import ExpiringSet
+import threading
+
+
+class EventDeduplicator:
+    """Remembers recently seen Slack event IDs so that retried deliveries can be dropped.
+
+    IDs are kept for `ttl` seconds (at most `maxsize` of them) in an ExpiringSet,
+    optionally shared through a Mongo collection; this adds the hit/miss counters.
+    """
+
+    def __init__(self, ttl, maxsize, collection=None):
+        self.events = ExpiringSet(ttl, maxsize=maxsize, collection=collection)
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.retries = 0
+
+    def seen(self, event_id, retry_num=None):
+        """Return True if `event_id` was already processed, otherwise remember it."""
+        new = self.events.add(event_id)
+        with self._lock:
+            if retry_num is not None:
+                self.retries += 1
+            if new:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return not new
+
+    def forget(self, event_id):
+        """Drop `event_id`, so that Slack's retry of an event that failed is processed."""
+        self.events.discard(event_id)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "tracked": len(self.events),
+                "hits": self.hits,
+                "misses": self.misses,
+                "retries_received": self.retries,
+                "hit_rate": self.hits / total if total else None,
+            }
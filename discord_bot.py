@@ -1,58 +1,101 @@
 import discord
 from discord import Intents, Client, Message, MessageType
 from discord.ext import commands
-from slack_sdk.errors import SlackApiError
+from slack_sdk.web.async_client import AsyncWebClient
 import config
 import db
+import file_shares
+import http_session
+import logs
+import metrics
+import tracing
+from dispatcher import outbound
+from coalesce import coalescer
+from cache import TTLCache
 import urllib.parse
-import aiohttp
-import os
-import time
+import asyncio
 import re
 import json
 import logging
 from config import DISCORD_CHANNELS_DICT
 
+logger = logging.getLogger(__name__)
+
+# Discord -> Slack goes through the async client so Slack round trips never block the gateway.
+# It shares the process-wide HTTP session, opened in setup_hook on the Discord loop.
+async_slack_client = AsyncWebClient(token=config.SLACK_TOKEN)
+
+# Discord thread id -> ts of the Slack message the thread replies to.
+# A thread opened from a message has the same id as that message, so relayed
+# messages are added as soon as their Slack ts is known.
+thread_parents = TTLCache(config.THREAD_CACHE_MAX_SIZE)
+
+class RelayClient(Client):
+    async def setup_hook(self):
+        async_slack_client.session = await http_session.open_session()
+
+    async def close(self):
+        await super().close()
+        await http_session.close_session()
+        await db.close_async_client()
+        await asyncio.to_thread(db.shutdown)
+
 intents = Intents.default()
 intents.message_content = True 
-discord_client = Client(intents=intents)
+discord_client = RelayClient(intents=intents)
 
 @discord_client.event
 async def on_ready():
-    logger(f'{discord_client.user} is now running!')
+    logger.info('%s is now running!', discord_client.user)
+
+    # Slack events wait in the durable queue until Discord is ready to receive them
+    from slack_bot import start_event_workers
+    start_event_workers()
 
 @discord_client.event
 async def on_message(message: Message):
     if message.author == discord_client.user:
         return json.dumps({"status":"ignored"})  
 
+    trace_id = tracing.new_trace_id()
+    logs.bind(direction='discord->slack', channel=message.channel.id, source=message.id, trace=trace_id)
+
+    with tracing.span('discord_message', trace_id):
+        return await relay_message(message)
+
+async def relay_message(message: Message):
     # Проверяем тип канала
     if isinstance(message.channel, discord.TextChannel):
-        logger(f'\n-------DISCORD - NEW MESSAGE-------\n---> {message.content}')
+        logger.debug('DISCORD - NEW MESSAGE: %s', message.content)
         result = await send_new_message_to_slack(message)
         return result
 
     elif isinstance(message.channel, discord.Thread):
         if message.type == MessageType.default:
-            logger(f'\n-------DISCORD - THREAD MESSAGE-------\n---> {message.content}')
+            logger.debug('DISCORD - THREAD MESSAGE: %s', message.content)
             result = await send_thread_message_to_slack(message)
             return result
 
         elif message.type == MessageType.reply:
-            logger(f'\n-------DISCORD - REPLY MESSAGE IN THREAD-------\n---> {message.content}')
-            
-            # Получение ссылки на сообщение, на которое был дан ответ
-            replied_message = await message.channel.fetch_message(message.reference.message_id)
-            logger(f'REPLIED MESSAGE: {replied_message.content}')
+            logger.debug('DISCORD - REPLY MESSAGE IN THREAD: %s', message.content)
+            logger.debug('REPLIED MESSAGE: %s', message.reference.message_id)
 
             result = await send_thread_message_to_slack(message)
             return result
         else:
-            logger('UNKNOWN ACTION IN DISCORD THREAD')
+            logger.info('UNKNOWN ACTION IN DISCORD THREAD')
             return json.dumps({"status":"unknown"})  
     else:
-        logger('UNKNOWN ACTION IN DISCORD')
+        logger.info('UNKNOWN ACTION IN DISCORD')
         return json.dumps({"status":"unknown"})  
+
+@discord_client.event
+async def on_thread_create(thread):
+    slack_parent_message_id = await get_thread_parent(thread)
+    if slack_parent_message_id:
+        logger.info('New Discord thread %s replies to Slack message %s', thread.id, slack_parent_message_id)
+        # Ответы из Slack пойдут сразу в эту ветку, без поиска через fetch_message
+        await db.save_thread_id_async(thread.id, thread.id)
  
 
 #------------------------------------------
@@ -60,156 +103,165 @@ async def on_message(message: Message):
 #------------------------------------------
 
 async def send_new_message_to_slack(message: Message):
-    from slack_bot import slack_client
     discord_message_id = message.id
 
     try:
-        channel_to_send, text = choose_channel(message)
+        channel_to_send, header, user_message = choose_channel(message)
     except ValueError:
         return
-    
-    if message.attachments:
-        logger('MESSAGE WITH FILES')
-
-        file_paths, files = await collect_files(message)
-
-        response = slack_client.files_upload_v2(
-            channel=channel_to_send,
-            initial_comment=text,
-            file_uploads=[{
-                'file': file['file'],
-                'filename': file['filename']
-            } for file in files]
-            )      
-
-        slack_message_id = wait_message_ID(slack_client, response)
-        delete_files(file_paths)
+
+    if not message.attachments and coalescer.accepts(header, user_message):
+        async def deliver(text, discord_message_ids):
+            return await post_new_message_to_slack(channel_to_send, text, discord_message_ids)
+
+        return await coalescer.submit(
+            ('slack', channel_to_send), message.author.id, header, user_message, discord_message_id, deliver
+        )
+
+    # Anything pending for this channel goes out first
+    await coalescer.drain_channel(('slack', channel_to_send))
+    text = f'{header}\n{user_message}'
+
+    # Если ни одно вложение не скачалось, отправляем хотя бы текст
+    files = await collect_files(message) if message.attachments else []
+    if message.attachments and not files:
+        logger.warning('No attachment of Discord message %s could be downloaded, sending its text only', discord_message_id)
+
+    if files:
+        logger.debug('MESSAGE WITH FILES')
+
+        try:
+            response = await outbound.submit(('slack', channel_to_send), 'slack.files_upload', lambda: async_slack_client.files_upload_v2(
+                channel=channel_to_send,
+                initial_comment=text,
+                file_uploads=[{
+                    'file': rewind(file['file']),
+                    'filename': file['filename']
+                } for file in files]
+                ))
+        finally:
+            close_files(files)
+
+        slack_message_id = await wait_message_ID(async_slack_client, response)
+        return await save_new_message_mappings(channel_to_send, slack_message_id, [discord_message_id])
     else:
-        logger('MESSAGE WITHOUT FILES')
+        logger.debug('MESSAGE WITHOUT FILES')
+        return await post_new_message_to_slack(channel_to_send, text, [discord_message_id])
 
-        response = slack_client.chat_postMessage(
-            channel=channel_to_send,  # Укажите ID канала Slack, куда отправлять
-            text=text
-        ) 
-        slack_message_id = response['ts']
-    
-    result = slack_client.conversations_info(channel=channel_to_send)
-    channel_name = result['channel']['name']
+async def post_new_message_to_slack(channel_to_send, text, discord_message_ids):
+    response = await outbound.submit(('slack', channel_to_send), 'slack.chat_postMessage', lambda: async_slack_client.chat_postMessage(
+        channel=channel_to_send,  # Укажите ID канала Slack, куда отправлять
+        text=text
+    ))
+    return await save_new_message_mappings(channel_to_send, response['ts'], discord_message_ids)
 
-    logger(f'New message sent to Slack: #{channel_name}!')
+async def save_new_message_mappings(channel_to_send, slack_message_id, discord_message_ids):
+    channel_name = await get_channel_name(channel_to_send)
+    logger.info('New message sent to Slack: #%s', channel_name)
 
     if slack_message_id:
-        db.save_message_to_db(slack_message_id, discord_message_id)
-        logger("---> 'send_new_message_to_slack' func is done")
+        # Каждое исходное сообщение получает свою запись, чтобы ответы на любое из них находили Slack-сообщение
+        for discord_message_id in discord_message_ids:
+            await db.save_message_to_db_async(slack_message_id, discord_message_id)
+            thread_parents.set(discord_message_id, slack_message_id)
+        logger.debug("'send_new_message_to_slack' func is done")
         return json.dumps({"status":"ok"})  
     else:
-        logger('---> slack_message_id is empty')
+        logger.warning('slack_message_id is empty')
         return json.dumps({"status":"false"})
 
-def wait_message_ID(slack_client, response):
-# Polling the files.info API to get the 'shares' property with ts and thread_ts
+async def wait_message_ID(slack_client, response):
+    # Other Discord messages keep flowing while the share of the first file resolves
     file_id = response['files'][0]['id']
+    with metrics.stage('file_share_wait'):
+        return await file_shares.wait_for_share(
+            slack_client,
+            file_id,
+            timeout=config.FILE_SHARE_TIMEOUT,
+            initial_delay=config.FILE_SHARE_POLL_INITIAL_DELAY,
+            max_delay=config.FILE_SHARE_POLL_MAX_DELAY
+        )
+
+async def get_thread_parent(thread):
+    """Slack ts of the message `thread` replies to, or None if its starter was never relayed."""
+    slack_parent_message_id = thread_parents.get(thread.id)
+    if slack_parent_message_id:
+        return slack_parent_message_id
 
-    while True:
-        try:
-            file_info = slack_client.files_info(file=file_id)
-            # print('----- file_info -----\n', file_info)
-            shares = file_info['file'].get('shares')
-            
-            if shares:
-                logger(f'----- SHARES -----\n%s: {shares}')
-
-                if 'private' in shares and shares['private']:
-                    shared_channels = list(shares['private'].keys())
-                    if shared_channels:
-                        channel = shared_channels[0]
-                        ts = shares['private'][channel][0]['ts']  # Извлечение ts для private
-                        logger(f"Parent message ts (private): {ts}")
-                        return ts
-                    
-                elif 'public' in shares and shares['public']:
-                    shared_channels = list(shares['public'].keys())
-                    if shared_channels:
-                        channel = shared_channels[0]
-                        ts = shares['public'][channel][0]['ts']  # Извлечение ts для public
-                        logger("Parent message ts (public): {ts}")
-                        return ts
-                else:
-                    logger("No shares found in public or private sections.")
-                    return None
-                
-            logger('NO SHARES YET')
-            time.sleep(1)  # Wait 1 second before polling again
-        except SlackApiError as e:
-            logger(f"""Error retrieving file info: {e.response['error']}""")
-            exit()
+    # Стартовое сообщение ветки имеет тот же ID, что и сама ветка, поэтому fetch_message не нужен.
+    # The starter may still be waiting in a burst.
+    await coalescer.flush_source(thread.id)
+    slack_parent_message_id = await db.get_slack_message_id_async(thread.id)
+    if slack_parent_message_id:
+        thread_parents.set(thread.id, slack_parent_message_id)
+    return slack_parent_message_id
 
 async def send_thread_message_to_slack(message: Message):
-    from slack_bot import slack_client
-
-  # Получаем ID родительского сообщения
-    discord_parent_message = await message.channel.parent.fetch_message(message.channel.id)
-    discord_parent_message_id = discord_parent_message.id
-
-    result = db.messages_collection.find_one({"discord_message_id": discord_parent_message_id})
-    slack_parent_message_id = result['slack_message_id'] if result else None
+    slack_parent_message_id = await get_thread_parent(message.channel)
 
     if slack_parent_message_id:
         try:
-            channel_to_send, text = choose_channel(message)
+            channel_to_send, header, user_message = choose_channel(message)
         except ValueError:
             return
+        text = f'{header}\n{user_message}'
 
-        if message.attachments:
-            logger('MESSAGE WITH FILES')
+        # Если ни одно вложение не скачалось, отправляем хотя бы текст
+        files = await collect_files(message) if message.attachments else []
+        if message.attachments and not files:
+            logger.warning('No attachment of Discord message %s could be downloaded, sending its text only', message.id)
 
-            file_paths, files = await collect_files(message)
+        if files:
+            logger.debug('MESSAGE WITH FILES')
 
             # Upload all files at once using files_upload_v2
-            response = slack_client.files_upload_v2(
-                channels=channel_to_send,
-                initial_comment=text,
-                file_uploads=[{
-                    'file': file['file'],
-                    'filename': file['filename']
-                } for file in files], 
-                thread_ts=slack_parent_message_id
-            )
-
-            delete_files(file_paths)
+            try:
+                response = await outbound.submit(('slack', channel_to_send), 'slack.files_upload', lambda: async_slack_client.files_upload_v2(
+                    channels=channel_to_send,
+                    initial_comment=text,
+                    file_uploads=[{
+                        'file': rewind(file['file']),
+                        'filename': file['filename']
+                    } for file in files], 
+                    thread_ts=slack_parent_message_id
+                ))
+            finally:
+                close_files(files)
 
         else:
-            logger('MESSAGE WITHOUT IMAGE')
+            logger.debug('MESSAGE WITHOUT IMAGE')
 
-            response = slack_client.chat_postMessage(
+            response = await outbound.submit(('slack', channel_to_send), 'slack.chat_postMessage', lambda: async_slack_client.chat_postMessage(
                 channel=channel_to_send,  # Укажите ID канала Slack, куда отправлять
                 text=text,
                 thread_ts=slack_parent_message_id
-            ) 
+            ))
 
         if response.get('ok'): 
-            result = slack_client.conversations_info(channel=channel_to_send)
-            channel_name = result['channel']['name']
-
-            logger(f'Thread message sent to Slack: #{channel_name}')
-            logger("---> 'send_thread_message_to_slack' func is done")
+            channel_name = await get_channel_name(channel_to_send)
+            logger.info('Thread message sent to Slack: #%s', channel_name)
+            logger.debug("'send_thread_message_to_slack' func is done")
 
             return json.dumps({"status":"ok"})  
         else:
-            logger(f"""Ошибка при загрузке файла: {response.get('error')}""")
+            logger.error('Ошибка при загрузке файла: %s', response.get('error'))
             return json.dumps({"status":"false"})  
 
+async def get_channel_name(channel_id):
+    from slack_bot import channel_directory
+    return await channel_directory.get_name_async(async_slack_client, channel_id)
+
 def format_mentions(message):
     user_message = str(message.content)
     mentions = message.mentions
     if mentions:
-        logger('Mentions were found!')
+        logger.debug('Mentions were found!')
         for mention in mentions:
             user_id = f'@{mention.id}'
             user_message = user_message.replace(f'<@{mention.id}>', f'@{mention.display_name}')
             return user_message
     else:
-        logger('Mentions was not found!')
+        logger.debug('Mentions was not found!')
         return user_message
 
 def choose_channel(message):
@@ -224,82 +276,58 @@ def choose_channel(message):
     user_message = format_mentions(message)
     user_name = message.author.display_name
 
-    logger(f'Message from user: {user_name}')
-    logger(f'Message in channel: {channel_name}, ID: {channel_id}')
+    logger.debug('Message from user: %s', user_name)
+    logger.debug('Message in channel: %s, ID: %s', channel_name, channel_id)
 
     # Проверка наличия канала в словаре и создание текста для отправки
     if channel_id in DISCORD_CHANNELS_DICT:
         slack_channel = DISCORD_CHANNELS_DICT[channel_id]
 
-        text = f'💂*_{user_name}_*\n{user_message}'
-        return slack_channel, text 
+        header = f'💂*_{user_name}_*'
+        return slack_channel, header, user_message
     
     else:
         # return
-        logger(f'DISCORD - MESSAGE FROM OTHER CHANNEL - #{channel_name}')
+        logger.debug('DISCORD - MESSAGE FROM OTHER CHANNEL - #%s', channel_name)
         if channel_name != None:
             channel_to_send = config.SLACK_CHANNEL_DISCORD
-            text = f'💂*_{user_name}_* 🔉*_#{channel_name}_*\n{user_message}'
-            return channel_to_send, text
+            header = f'💂*_{user_name}_* 🔉*_#{channel_name}_*'
+            return channel_to_send, header, user_message
         else:
-            logger('UNKNOWN CHANNEL NAME')
+            logger.warning('UNKNOWN CHANNEL NAME')
             return
 
 async def collect_files(message):
-    # Download images to disk
-    file_paths = []
-    for attachment in message.attachments:
-        if attachment.url:
-            image_path = await download_image_from_discord(attachment.url)
-            if image_path:
-                file_paths.append(image_path)
-
-    # Prepare the files to be uploaded
-    if file_paths :
-        files = []
-        for file_path in file_paths:
-            with open(file_path, 'rb') as file:
-                files.append({
-                    'file': file.read(),  # Read the file content into memory
-                    'filename': os.path.basename(image_path)
-                })
-
-    return file_paths, files
-
-async def download_image_from_discord(image_url):
+    # Stream attachments into buffers, concurrently and in attachment order
+    per_message = asyncio.Semaphore(config.DOWNLOAD_CONCURRENCY_PER_MESSAGE)
+    files = await asyncio.gather(*(
+        download_image_from_discord(attachment.url, per_message)
+        for attachment in message.attachments if attachment.url
+    ))
+    return [file for file in files if file]
+
+async def download_image_from_discord(image_url, per_message):
     # Sanitize the image URL to remove query parameters and other invalid characters for filenames
     sanitized_name = urllib.parse.unquote(image_url.split("/")[-1].split("?")[0])
     
     # Ensure the file name is safe by removing invalid characters
     sanitized_name = re.sub(r'[<>:"/\\|?*]', '_', sanitized_name)
     
-    os.makedirs("temp_files", exist_ok=True)
-    image_path = f"temp_files/{sanitized_name}"
-
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(image_url) as response:
-                if response.status == 200:
-                    with open(image_path, 'wb') as f:
-                        f.write(await response.read())
-                    logger(f"Downloaded image from Discord: {image_url}")
-                    return image_path
-                else:
-                    logger(f"Failed to download image: {image_url}")
-    except Exception as e:
-        logger(f"Error downloading image from {image_url}: {e}")
-    return None
-
-def delete_files(file_paths):
-
-    """Delete files after they have been used."""
-    for file_path in file_paths:
+    async with per_message, http_session.download_slots:
         try:
-            os.remove(file_path)
-            logger(f"Deleted image: {file_path}")
+            buffer = await http_session.download_to_buffer(image_url)
+            logger.debug("Downloaded image from Discord: %s", image_url)
+            return {'file': buffer, 'filename': sanitized_name}
         except Exception as e:
-            logger(f"Error deleting image {file_path}: {e}")
+            logger.error("Error downloading image from %s: %r", image_url, e)
+    return None
+
+def rewind(buffer):
+    # A retried upload must read the attachment from the start again
+    buffer.seek(0)
+    return buffer
 
-def logger(log_text):
-    print(log_text)
-    logging.info(log_text)
\ No newline at end of file
+def close_files(files):
+    """Release attachment buffers after they have been uploaded."""
+    for file in files:
+        file['file'].close()
@@ -0,0 +1,232 @@
+from collections import deque
+import contextvars
+from slack_sdk.errors import SlackApiError
+import aiohttp
+import discord
+import asyncio
+import time
+import logging
+import metrics
+import config
+
+logger = logging.getLogger(__name__)
+
+# route: (requests per second, burst, limited per destination channel)
+ROUTE_LIMITS = {
+    'slack.chat_postMessage': (1.0, 3, True),    # Slack: about one message per second per channel
+    'slack.files_upload': (20 / 60, 5, False),   # Slack Tier 2, per workspace
+    'discord.messages': (1.0, 5, True),          # Discord: 5 messages per 5 seconds per channel
+}
+
+# Stage names of the routes in the relay metrics
+ROUTE_STAGES = {
+    'slack.chat_postMessage': 'slack_post',
+    'slack.files_upload': 'slack_upload',
+    'discord.messages': 'discord_send',
+}
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self):
+        """Seconds until a request may go out on this bucket (0 if it may go now)."""
+        now = time.monotonic()
+        self._refill(now)
+        if now < self.paused_until:
+            return self.paused_until - now
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def pause(self, seconds):
+        # Retry-After from the API overrides the local estimate
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+
+class Job:
+    def __init__(self, route, send, future):
+        self.route = route
+        self.send = send
+        self.future = future
+        self.attempts = 0
+        # The send runs in the submitter's context, so its logs and spans belong to that message
+        self.context = contextvars.copy_context()
+
+
+def error_status(error):
+    """HTTP status of a failed Slack, Discord or download call, for the error metrics."""
+    if isinstance(error, SlackApiError):
+        return error.response.status_code
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status
+    if isinstance(error, discord.RateLimited):
+        return 429
+    if isinstance(error, discord.HTTPException):
+        return error.status
+    return 'error'
+
+
+def route_direction(route):
+    return 'discord->slack' if route.startswith('slack.') else 'slack->discord'
+
+
+def rate_limit_delay(error):
+    """Retry-After in seconds if `error` is a 429 from Slack or Discord, otherwise None."""
+    if isinstance(error, SlackApiError) and error.response.status_code == 429:
+        return float(error.response.headers.get('Retry-After', 1))
+    if isinstance(error, discord.RateLimited):
+        return error.retry_after
+    if isinstance(error, discord.HTTPException) and error.status == 429:
+        return float(error.response.headers.get('Retry-After', 1))
+    if isinstance(error, aiohttp.ClientResponseError) and error.status == 429:
+        return float((error.headers or {}).get('Retry-After', 1))
+    return None
+
+
+def record_failure(direction, route, error):
+    """Count a failed call in api_errors (and rate_limited for a 429); returns its Retry-After or None."""
+    metrics.api_errors.inc(direction, route, error_status(error))
+    retry_after = rate_limit_delay(error)
+    if retry_after is not None:
+        metrics.rate_limited.inc(direction, route)
+    return retry_after
+
+
+class OutboundDispatcher:
+    """Central scheduler for sends to Slack and Discord.
+
+    Each destination channel has a FIFO queue with at most one send in flight, so
+    messages for a channel keep their order. Destinations take turns, so one hot
+    channel cannot starve the others. Token buckets model the API rate limits, and
+    a 429 pauses its bucket for Retry-After seconds before the send is retried.
+    """
+
+    def __init__(self, limits, max_retries):
+        self.limits = limits
+        self.max_retries = max_retries
+        self._queues = {}         # destination -> deque of Job
+        self._rotation = deque()  # destinations with queued work and nothing in flight
+        self._in_flight = set()
+        self._tasks = set()
+        self._buckets = {}
+        self._wakeup = None
+        self._runner = None
+
+        self.sent = 0
+        self.failed = 0
+        self.rate_limited = 0
+
+    async def submit(self, destination, route, send):
+        """Queue `send` (a coroutine function) for `destination` and return its result."""
+        loop = asyncio.get_running_loop()
+        if self._runner is None or self._runner.done():
+            self._wakeup = asyncio.Event()
+            self._runner = loop.create_task(self._run())
+
+        job = Job(route, send, loop.create_future())
+        self._queues.setdefault(destination, deque()).append(job)
+        if destination not in self._in_flight and destination not in self._rotation:
+            self._rotation.append(destination)
+        self._wakeup.set()
+        return await job.future
+
+    def _bucket(self, route, destination):
+        rate, burst, per_channel = self.limits[route]
+        key = (route, destination if per_channel else None)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(rate, burst)
+        return bucket
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            wait = None
+
+            for _ in range(len(self._rotation)):
+                destination = self._rotation.popleft()
+                jobs = self._queues[destination]
+                # Отменённые отправки (например, событие вышло за SLACK_EVENT_TIMEOUT
+                # и будет повторено) не выполняем, иначе сообщение уйдёт дважды
+                while jobs and jobs[0].future.cancelled():
+                    jobs.popleft()
+                if not jobs:
+                    del self._queues[destination]
+                    continue
+                job = jobs[0]
+                bucket = self._bucket(job.route, destination)
+
+                delay = bucket.delay()
+                if delay > 0:
+                    # Этот канал ждёт лимит; остальные каналы идут дальше
+                    self._rotation.append(destination)
+                    wait = delay if wait is None else min(wait, delay)
+                    continue
+
+                bucket.take()
+                self._queues[destination].popleft()
+                self._in_flight.add(destination)
+                task = job.context.run(asyncio.create_task, self._send(destination, job))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _send(self, destination, job):
+        direction = route_direction(job.route)
+        try:
+            with metrics.stage(ROUTE_STAGES[job.route], direction):
+                result = await job.send()
+        except Exception as e:
+            retry_after = record_failure(direction, job.route, e)
+            if retry_after is not None:
+                self.rate_limited += 1
+            if retry_after is not None and job.attempts < self.max_retries:
+                logger.warning('Rate limited on %s for %s, retrying in %ss', job.route, destination, retry_after)
+                job.attempts += 1
+                self._bucket(job.route, destination).pause(retry_after)
+                self._queues[destination].appendleft(job)
+            else:
+                self.failed += 1
+                if not job.future.done():
+                    job.future.set_exception(e)
+        else:
+            self.sent += 1
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            self._in_flight.discard(destination)
+            if self._queues[destination]:
+                self._rotation.append(destination)
+            else:
+                del self._queues[destination]
+            self._wakeup.set()
+
+    def stats(self):
+        return {
+            "sent": self.sent,
+            "failed": self.failed,
+            "rate_limited": self.rate_limited,
+            "in_flight": len(self._in_flight),
+            "queued": {f'{platform}:{channel}': len(queue) for (platform, channel), queue in list(self._queues.items())},
+        }
+
+
+outbound = OutboundDispatcher(ROUTE_LIMITS, config.OUTBOUND_MAX_RETRIES)
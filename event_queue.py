@@ -0,0 +1,155 @@
+import sqlite3
+import threading
+import time
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class EventQueue:
+    """Durable FIFO of Slack event payloads backed by a local SQLite file.
+
+    A failed event is retried after `retry_delay` seconds, doubling with each
+    attempt up to `retry_max_delay`, so a short Slack or Discord outage does not
+    use up all of its attempts at once.
+    """
+
+    def __init__(self, path, max_attempts=3, retry_delay=10, retry_max_delay=600):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.retry_max_delay = retry_max_delay
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                payload TEXT NOT NULL,
+                enqueued_at REAL NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                claimed_at REAL,
+                available_at REAL NOT NULL DEFAULT 0
+            )""")
+        # Очереди, созданные до появления отложенных повторов
+        columns = [row[1] for row in self._conn.execute('PRAGMA table_info(events)')]
+        if 'available_at' not in columns:
+            self._conn.execute('ALTER TABLE events ADD COLUMN available_at REAL NOT NULL DEFAULT 0')
+        # Events claimed by a previous process that died mid-delivery go back to the queue
+        self._conn.execute('UPDATE events SET claimed_at = NULL WHERE claimed_at IS NOT NULL')
+
+        self.delivered = 0
+        self.failed = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.latency_last = None
+
+    def put(self, event_data):
+        payload = json.dumps(event_data, ensure_ascii=False)
+        with self._not_empty:
+            self._conn.execute(
+                'INSERT INTO events (payload, enqueued_at) VALUES (?, ?)',
+                (payload, time.time())
+            )
+            self._not_empty.notify()
+
+    def get(self, timeout=None):
+        """Claim the oldest event that is due. Returns (id, event_data, enqueued_at) or None on timeout."""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+
+        with self._not_empty:
+            while True:
+                now = time.time()
+                row = self._conn.execute(
+                    'SELECT id, payload, enqueued_at FROM events '
+                    'WHERE claimed_at IS NULL AND available_at <= ? ORDER BY id LIMIT 1',
+                    (now,)
+                ).fetchone()
+                if row:
+                    self._conn.execute(
+                        'UPDATE events SET claimed_at = ?, attempts = attempts + 1 WHERE id = ?',
+                        (now, row[0])
+                    )
+                    return row[0], json.loads(row[1]), row[2]
+
+                # Nothing is due: sleep until the next retry, a put, or the timeout
+                next_retry, = self._conn.execute(
+                    'SELECT MIN(available_at) FROM events WHERE claimed_at IS NULL'
+                ).fetchone()
+                wait = next_retry - now if next_retry is not None else None
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return None
+                    wait = remaining if wait is None else min(wait, remaining)
+                self._not_empty.wait(wait)
+
+    def ack(self, item_id, enqueued_at):
+        latency = time.time() - enqueued_at
+        with self._lock:
+            self._conn.execute('DELETE FROM events WHERE id = ?', (item_id,))
+            self.delivered += 1
+            self.latency_total += latency
+            self.latency_max = max(self.latency_max, latency)
+            self.latency_last = latency
+
+    def nack(self, item_id):
+        """Put a failed event back to be retried after a backoff, or drop it once it has used up its attempts."""
+        with self._not_empty:
+            row = self._conn.execute('SELECT attempts FROM events WHERE id = ?', (item_id,)).fetchone()
+            if row is None:
+                return
+            attempts, = row
+            if attempts >= self.max_attempts:
+                self._conn.execute('DELETE FROM events WHERE id = ?', (item_id,))
+                self.failed += 1
+                logger.error('Slack event %s dropped after %d attempts', item_id, attempts)
+            else:
+                delay = min(self.retry_delay * 2 ** (attempts - 1), self.retry_max_delay)
+                self._conn.execute(
+                    'UPDATE events SET claimed_at = NULL, available_at = ? WHERE id = ?',
+                    (time.time() + delay, item_id)
+                )
+                logger.warning('Slack event %s will be retried in %ss (attempt %d of %d failed)', item_id, delay, attempts, self.max_attempts)
+                self._not_empty.notify()
+
+    def stats(self):
+        with self._lock:
+            depth, in_flight, retrying = self._conn.execute(
+                'SELECT COUNT(*), COUNT(claimed_at), COUNT(CASE WHEN claimed_at IS NULL AND available_at > ? THEN 1 END) FROM events',
+                (time.time(),)
+            ).fetchone()
+            return {
+                "depth": depth - in_flight,
+                "in_flight": in_flight,
+                "retrying": retrying,
+                "delivered": self.delivered,
+                "failed": self.failed,
+                "latency_last": self.latency_last,
+                "latency_avg": self.latency_total / self.delivered if self.delivered else None,
+                "latency_max": self.latency_max,
+            }
+
+
+def start_workers(queue, handler, count):
+    """Start `count` daemon threads that feed queued events to `handler`."""
+    def work():
+        while True:
+            item_id, event_data, enqueued_at = queue.get()
+            try:
+                handler(event_data)
+                queue.ack(item_id, enqueued_at)
+            except Exception:
+                logger.exception('Error processing queued Slack event %s', item_id)
+                queue.nack(item_id)
+
+    workers = []
+    for i in range(count):
+        worker = threading.Thread(target=work, name=f'slack-worker-{i}', daemon=True)
+        worker.start()
+        workers.append(worker)
+    return workers
@@ -0,0 +1,95 @@
+from slack_sdk.errors import SlackApiError
+from dispatcher import record_failure
+from cache import TTLCache
+import asyncio
+import threading
+import metrics
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Ожидающие загрузки: file_id -> (loop, future), заполняется wait_for_share
+_pending = {}
+_pending_lock = threading.Lock()
+# Shares seen before anyone started waiting for them
+_recent_shares = TTLCache(maxsize=1000, ttl=300)
+
+
+def notify_share(file_id, ts):
+    """Record that the Slack message `ts` carries `file_id` and wake up its waiter.
+
+    Safe to call from any thread.
+    """
+    _recent_shares.set(file_id, ts)
+    with _pending_lock:
+        entry = _pending.get(file_id)
+    if entry:
+        loop, future = entry
+        loop.call_soon_threadsafe(_resolve, future, ts)
+
+
+def _resolve(future, ts):
+    if not future.done():
+        future.set_result(ts)
+
+
+async def wait_for_share(slack_client, file_id, timeout, initial_delay, max_delay):
+    """Resolve the ts of the message an uploaded file was shared in.
+
+    Waits for the Slack message event for the file and, in the meantime, polls
+    files.info with capped exponential backoff. Returns None after `timeout` seconds.
+    """
+    ts = _recent_shares.get(file_id)
+    if ts:
+        return ts
+
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    with _pending_lock:
+        _pending[file_id] = (loop, future)
+
+    try:
+        deadline = loop.time() + timeout
+        delay = initial_delay
+        while True:
+            ts = await poll_share(slack_client, file_id)
+            if ts:
+                return ts
+
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                logger.error('Timed out waiting for share of file %s', file_id)
+                return None
+
+            try:
+                return await asyncio.wait_for(asyncio.shield(future), min(delay, remaining))
+            except asyncio.TimeoutError:
+                delay = min(delay * 2, max_delay)
+    finally:
+        with _pending_lock:
+            _pending.pop(file_id, None)
+
+
+async def poll_share(slack_client, file_id):
+    # Polling the files.info API (AsyncWebClient) to get the 'shares' property with ts
+    try:
+        file_info = await slack_client.files_info(file=file_id)
+    except SlackApiError as e:
+        record_failure(metrics.current_direction(), 'slack.files_info', e)
+        logger.error('Error retrieving file info: %s', e.response['error'])
+        return None
+
+    shares = file_info['file'].get('shares')
+    if not shares:
+        logger.debug('NO SHARES YET')
+        return None
+
+    for visibility in ('private', 'public'):
+        if shares.get(visibility):
+            channel = next(iter(shares[visibility]))
+            ts = shares[visibility][channel][0]['ts']
+            logger.debug('Parent message ts (%s): %s', visibility, ts)
+            return ts
+
+    logger.debug('No shares found in public or private sections.')
+    return None
@@ -0,0 +1,78 @@
+from logging.handlers import QueueListener, RotatingFileHandler, TimedRotatingFileHandler
+from datetime import datetime, timezone
+from logs import EnqueueOnlyHandler
+import fastjson
+import logging
+import atexit
+import random
+import queue
+import config
+
+# HTTP-аудит: запросные потоки только кладут запись в очередь,
+# форматирование, редактирование заголовков и запись в файл идут в потоке QueueListener
+
+REDACTED = '[redacted]'
+
+
+class JSONLineFormatter(logging.Formatter):
+    """One compact JSON object per line, with sensitive headers redacted."""
+
+    def __init__(self, redact_headers):
+        super().__init__()
+        self.redact_headers = {name.lower() for name in redact_headers}
+
+    def format(self, record):
+        entry = {'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(), **record.msg}
+        for key in ('request_headers', 'response_headers'):
+            if key in entry:
+                entry[key] = self.redact(entry[key])
+        for key in ('request_body', 'response_body'):
+            if isinstance(entry.get(key), bytes):
+                entry[key] = entry[key].decode('utf-8', errors='replace')
+        return fastjson.dumps(entry)
+
+    def redact(self, headers):
+        return {name: REDACTED if name.lower() in self.redact_headers else value for name, value in headers.items()}
+
+
+def file_handler():
+    if config.HTTP_LOG_ROTATION == 'time':
+        return TimedRotatingFileHandler(
+            config.HTTP_LOG_PATH, when=config.HTTP_LOG_ROTATE_WHEN, backupCount=config.HTTP_LOG_BACKUP_COUNT, encoding='utf-8'
+        )
+    return RotatingFileHandler(
+        config.HTTP_LOG_PATH, maxBytes=config.HTTP_LOG_MAX_BYTES, backupCount=config.HTTP_LOG_BACKUP_COUNT, encoding='utf-8'
+    )
+
+
+_queue = queue.SimpleQueue()
+
+http_logger = logging.getLogger('http_logger')
+http_logger.setLevel(logging.INFO)
+http_logger.propagate = False
+http_logger.addHandler(EnqueueOnlyHandler(_queue))
+
+_handler = file_handler()
+_handler.setFormatter(JSONLineFormatter(config.HTTP_LOG_REDACT_HEADERS))
+listener = QueueListener(_queue, _handler)
+listener.start()
+atexit.register(listener.stop)
+
+
+def log_exchange(method, url, request_headers, request_body, status, response_headers, response_body):
+    """Queue one request/response pair for the audit log.
+
+    Bodies may be parsed objects or raw bytes; they are serialised by the listener.
+    Errors are always logged, other exchanges with probability HTTP_LOG_SAMPLE_RATE.
+    """
+    if status < 400 and random.random() >= config.HTTP_LOG_SAMPLE_RATE:
+        return
+    http_logger.info({
+        "method": method,
+        "url": url,
+        "status": status,
+        "request_headers": request_headers,
+        "request_body": request_body,
+        "response_headers": response_headers,
+        "response_body": response_body,
+    })
@@ -0,0 +1,105 @@
+import aiohttp
+import asyncio
+import tempfile
+from dispatcher import record_failure
+import metrics
+import config
+
+# Единственная HTTP-сессия процесса; живёт в loop Discord-клиента
+_session = None
+
+# Attachment downloads in flight across all messages
+download_slots = asyncio.Semaphore(config.DOWNLOAD_CONCURRENCY)
+
+
+async def open_session():
+    """Create the shared, connection-pooled session. Called from RelayClient.setup_hook."""
+    global _session
+    connector = aiohttp.TCPConnector(
+        limit=config.HTTP_POOL_SIZE,
+        limit_per_host=config.HTTP_POOL_PER_HOST,
+        ttl_dns_cache=config.HTTP_DNS_CACHE_TTL,
+        keepalive_timeout=config.HTTP_KEEPALIVE_TIMEOUT
+    )
+    _session = aiohttp.ClientSession(connector=connector)
+    return _session
+
+
+def download_timeout():
+    """Per-file timeout for attachment downloads."""
+    return aiohttp.ClientTimeout(total=config.DOWNLOAD_TIMEOUT)
+
+
+async def download_to_buffer(url, headers=None):
+    """Stream `url` into a buffer that stays in memory up to ATTACHMENT_SPOOL_THRESHOLD bytes.
+
+    The caller owns (and must close) the returned buffer, rewound to the start.
+    Raises aiohttp.ClientResponseError for a non-200 response.
+    """
+    try:
+        with metrics.stage('file_download'):
+            async with get_session().get(url, headers=headers, timeout=download_timeout()) as response:
+                response.raise_for_status()
+                buffer = tempfile.SpooledTemporaryFile(max_size=config.ATTACHMENT_SPOOL_THRESHOLD)
+                try:
+                    async for chunk in response.content.iter_chunked(config.ATTACHMENT_CHUNK_SIZE):
+                        buffer.write(chunk)
+                except BaseException:
+                    buffer.close()
+                    raise
+                buffer.seek(0)
+                return buffer
+    except Exception as e:
+        record_failure(metrics.current_direction(), 'file_download', e)
+        raise
+
+
+def get_session():
+    if _session is None or _session.closed:
+        raise RuntimeError('Shared HTTP session is not open; the Discord client has not started yet')
+    return _session
+
+
+async def close_session():
+    global _session
+    if _session is not None:
+        await _session.close()
+        _session = None
+
+
+def is_open():
+    return _session is not None and not _session.closed
+
+
+def stats():
+    """Pool utilisation of the shared session's connector.
+
+    Reads state the Discord loop mutates, so call it on that loop (see stats_async).
+    """
+    if _session is None:
+        return {"open": False}
+
+    connector = _session.connector
+    # aiohttp has no public API for pool occupancy, so read the connector's bookkeeping
+    acquired_per_host = {
+        f'{key.host}:{key.port}': len(conns)
+        for key, conns in connector._acquired_per_host.items() if conns
+    }
+    idle_per_host = {
+        f'{key.host}:{key.port}': len(conns)
+        for key, conns in connector._conns.items() if conns
+    }
+    return {
+        "open": not _session.closed,
+        "limit": connector.limit,
+        "limit_per_host": connector.limit_per_host,
+        "in_use": len(connector._acquired),
+        "idle": sum(idle_per_host.values()),
+        "in_use_per_host": acquired_per_host,
+        "idle_per_host": idle_per_host,
+    }
+
+
+async def stats_async():
+    """stats() as a coroutine, for run_coroutine_threadsafe from other threads."""
+    return stats()
@@ -0,0 +1,79 @@
+from logging.handlers import QueueHandler, QueueListener
+import contextvars
+import logging
+import atexit
+import queue
+import sys
+import config
+
+# Общая настройка логирования: модули пишут в logging.getLogger(__name__),
+# записи только кладутся в очередь, а форматирование и вывод идут в потоке QueueListener
+
+# Context of the message being relayed (direction, channel, source, ...), added to every record
+_context = contextvars.ContextVar('log_context', default={})
+
+_listener = None
+
+
+class EnqueueOnlyHandler(QueueHandler):
+    """QueueHandler that leaves formatting to the listener thread.
+
+    The stock handler renders the message in the calling thread; here the record
+    keeps its args (and the current context) and is formatted by the listener.
+    """
+
+    def prepare(self, record):
+        record.context = _context.get()
+        return record
+
+
+class ContextFormatter(logging.Formatter):
+    """Appends the record's context as key=value pairs."""
+
+    def formatMessage(self, record):
+        text = super().formatMessage(record)
+        context = getattr(record, 'context', None)
+        if context:
+            text += ' | ' + ' '.join(f'{key}={value}' for key, value in context.items())
+        return text
+
+
+def bind(**values):
+    """Add key=value context to every later record of the current task and the tasks it starts.
+
+    Each Slack event and each Discord event handler runs in its own asyncio task
+    with its own copy of the context, so the values do not leak between messages.
+    """
+    _context.set({**_context.get(), **values})
+
+
+def context_value(key, default=None):
+    """A value bound with bind() for the current task."""
+    return _context.get().get(key, default)
+
+
+def current_context():
+    return _context.get()
+
+
+def setup():
+    """Route all logging through one queue to app.log (and stdout); called once at startup."""
+    global _listener
+    formatter = ContextFormatter('%(asctime)s - %(levelname)s - %(name)s - %(message)s')
+    handlers = [logging.FileHandler(config.LOG_FILE, mode='w', encoding='utf-8')]
+    if config.LOG_TO_STDOUT:
+        handlers.append(logging.StreamHandler(sys.stdout))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.setLevel(config.LOG_LEVEL)
+    root.addHandler(EnqueueOnlyHandler(log_queue))
+    # Per-module levels, e.g. LOG_LEVELS="slack_bot=DEBUG,discord=WARNING"
+    for name, level in config.LOG_LEVELS.items():
+        logging.getLogger(name).setLevel(level)
+
+    _listener = QueueListener(log_queue, *handlers)
+    _listener.start()
+    atexit.register(_listener.stop)
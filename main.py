@@ -1,60 +1,38 @@
-from flask import Flask, request, Response
+from flask import Flask, request, Response, jsonify, g
 from threading import Thread
-from slack_bot import slack_events
+from slack_bot import slack_events, event_queue, event_dedup, warm_directories, run_on_discord_loop
 from discord_bot import discord_client
+import http_session
+from dispatcher import outbound
+import db
+import http_log
+import logs
+import tracing
+import metrics
+import config
+import asyncio
 import os
-import logging
-import json
 
-# Настройка основного логгера
-logging.basicConfig(
-    level=logging.INFO,  # Уровень логирования
-    format='%(asctime)s - %(levelname)s - %(message)s',  # Формат лога
-    handlers=[
-        logging.FileHandler("app.log", mode='w', encoding="utf-8"),  # Логирование в файл app.log
-    ]
-)
-
-# Настройка логгера для HTTP-запросов
-http_logger = logging.getLogger("http_logger")
-http_handler = logging.FileHandler("http_requests.log", mode='w', encoding="utf-8")
-http_handler.setFormatter(logging.Formatter('%(asctime)s - %(message)s'))
-http_logger.addHandler(http_handler)
-http_logger.setLevel(logging.INFO)
+# Настройка основного логгера (вывод в отдельном потоке, см. logs.py)
+logs.setup()
+tracing.setup()
 
 app = Flask(__name__)
 
-def format_json(data):
-    try:
-        parsed = json.loads(data)
-        return json.dumps(parsed, indent=4, ensure_ascii=False)
-    except (json.JSONDecodeError, TypeError):
-        return data  # Если не JSON, вернуть как есть
-
-@app.before_request
-def log_request():
-    body = request.get_data(as_text=True)
-    formatted_body = format_json(body) if body else "No body"
-    headers = json.dumps(dict(request.headers), indent=4, ensure_ascii=False)
-    
-    http_logger.info(
-        f"Incoming request:\n"
-        f"Method: {request.method}\n"
-        f"URL: {request.url}\n"
-        f"Headers:\n{headers}\n"
-        f"Body:\n{formatted_body}"
-    )
-
 @app.after_request
-def log_response(response: Response):
-    formatted_response = format_json(response.get_data(as_text=True))
-    headers = json.dumps(dict(response.headers), indent=4, ensure_ascii=False)
-
-    http_logger.info(
-        f"Outgoing response:\n"
-        f"Status: {response.status_code}\n"
-        f"Headers:\n{headers}\n"
-        f"Body:\n{formatted_response}"
+def log_exchange(response: Response):
+    # Runs after the view, so the Slack payload is parsed once, by check_request.
+    # Serialising and writing happen off this thread (see http_log).
+    slack_payload = g.get('slack_payload')
+    slack_response = g.get('slack_response')
+    http_log.log_exchange(
+        request.method,
+        request.url,
+        dict(request.headers),
+        slack_payload if slack_payload is not None else request.get_data(),
+        response.status_code,
+        dict(response.headers),
+        slack_response if slack_response is not None else response.get_data()
     )
     return response
 
@@ -62,17 +40,52 @@ def log_response(response: Response):
 def home():
     return 'Both bots are running'
 
+@app.route('/metrics')
+def metrics_route():
+    # Prometheus text format; rendered only when scraped
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/queue')
+def queue_stats():
+    # Глубина очереди событий Slack и задержка от постановки в очередь до доставки
+    if event_queue is None:
+        return jsonify({"mode": "inline"})
+    return jsonify({"mode": "queue", **event_queue.stats()})
+
+@app.route('/dedup')
+def dedup_stats():
+    return jsonify(event_dedup.stats())
+
+@app.route('/http')
+def http_stats():
+    if not http_session.is_open():
+        return jsonify(http_session.stats())
+    # The connector's pools change on the Discord loop; take the snapshot there
+    return jsonify(run_on_discord_loop(http_session.stats_async(), timeout=5))
+
+@app.route('/outbound')
+def outbound_stats():
+    return jsonify(outbound.stats())
+
 # Flask route for Slack events
 app.add_url_rule('/slack/events', view_func=slack_events, methods=['POST'])
 
 # Start Flask server in a separate thread
 def run():
-    app.run(host="0.0.0.0", port=5000)
+    app.run(host=config.WEB_HOST, port=config.WEB_PORT)
     
 def keep_alive():
     t = Thread(target=run)
     t.start()
 
 if __name__ == '__main__':
-    keep_alive()
-    discord_client.run(os.environ['TOKEN_DISCORD'])
+    db.ensure_indexes()
+    Thread(target=warm_directories, daemon=True).start()
+    if config.WEB_SERVER == 'asgi':
+        # Webhook on uvicorn in the Discord client's loop
+        import asgi
+        asyncio.run(asgi.run())
+    else:
+        keep_alive()
+        # discord.py would add its own stderr handler; its records go through logs.setup() instead
+        discord_client.run(os.environ['TOKEN_DISCORD'], log_handler=None)
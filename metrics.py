@@ -0,0 +1,111 @@
+from contextlib import contextmanager
+from bisect import bisect_left
+import threading
+import time
+import tracing
+import logs
+
+# Метрики конвейера пересылки в текстовом формате Prometheus (/metrics).
+# Запись — поиск корзины и сложение под локом; текст собирается только при запросе.
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}  # label values -> count
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            values = list(self._values.items())
+        for labelvalues, value in values:
+            lines.append(f'{self.name}{{{format_labels(self.labelnames, labelvalues)}}} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames, buckets=BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._series = {}  # label values -> [counts per bucket (+Inf last), sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = [(labelvalues, list(counts), total) for labelvalues, (counts, total) in self._series.items()]
+        for labelvalues, counts, total in series:
+            labels = format_labels(self.labelnames, labelvalues)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{self.name}_bucket{{{labels},le="{le}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{labels}}} {total}')
+            lines.append(f'{self.name}_count{{{labels}}} {cumulative}')
+        return lines
+
+
+def format_labels(labelnames, labelvalues):
+    return ','.join(f'{name}="{escape(value)}"' for name, value in zip(labelnames, labelvalues))
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+stage_seconds = Histogram(
+    'relay_stage_seconds', 'Time spent in each stage of relaying a message.', ('direction', 'stage')
+)
+api_errors = Counter(
+    'relay_api_errors_total', 'Failed Slack and Discord API calls and file downloads, by HTTP status.', ('direction', 'route', 'status')
+)
+rate_limited = Counter(
+    'relay_rate_limited_total', 'Calls answered with 429 by Slack or Discord.', ('direction', 'route')
+)
+
+
+def current_direction():
+    # Направление задаёт logs.bind() в начале обработки сообщения
+    return logs.context_value('direction', 'unknown')
+
+
+@contextmanager
+def stage(name, direction=None):
+    """Time the enclosed block as stage `name` of the current message's direction.
+
+    The block is also recorded as a tracing span of the message's trace.
+    """
+    start = time.perf_counter()
+    with tracing.span(name):
+        try:
+            yield
+        finally:
+            stage_seconds.observe(time.perf_counter() - start, direction or current_direction(), name)
+
+
+def render():
+    lines = []
+    for metric in (stage_seconds, api_errors, rate_limited):
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
@@ -1,72 +1,219 @@
-from flask import Flask, jsonify, request
+from flask import Flask, jsonify, request, g
 from slack_sdk import WebClient
-from slack_sdk.errors import SlackApiError
 from slack_sdk.signature import SignatureVerifier
 import config
 from config import SLACK_TOKEN, SIGNING_SECRET, SLACK_CHANNELS_DICT
 import db
+from event_queue import EventQueue, start_workers
+from dedup import EventDeduplicator
+from slack_directory import UserDirectory, ChannelDirectory
+from cache import ExpiringSet
+import file_shares
+from dispatcher import outbound
+from coalesce import coalescer
+import http_session
+import fastjson
+import logs
+import metrics
+import tracing
 import asyncio
+import concurrent.futures
 import re
-import os
-import aiohttp
 import discord
-import time
-import json
+import weakref
 import logging
 
+logger = logging.getLogger(__name__)
+
 slack_client = WebClient(token=SLACK_TOKEN)
 signature_verifier = SignatureVerifier(signing_secret=SIGNING_SECRET)
 BOT_ID = slack_client.api_call("auth.test")['user_id']
-
-processed_files = set()
-file_timestamps = {}  # Словарь для хранения времени добавления файлов
-EXPIRATION_TIME = 300  # Время жизни записи в секундах (например, 5 минут)
+user_directory = UserDirectory(slack_client, config.USER_CACHE_TTL, config.USER_CACHE_MAX_SIZE)
+channel_directory = ChannelDirectory(slack_client, config.CHANNEL_CACHE_TTL, config.CHANNEL_CACHE_MAX_SIZE)
+
+# ID файлов из уже обработанных file_share, хранятся FILE_DEDUP_TTL секунд
+processed_files = ExpiringSet(
+    config.FILE_DEDUP_TTL,
+    collection=db.get_mongo_database()['Slack files'] if config.FILE_DEDUP_BACKEND == 'mongo' else None
+)
+
+event_queue = EventQueue(
+    config.SLACK_QUEUE_PATH,
+    config.SLACK_QUEUE_MAX_ATTEMPTS,
+    config.SLACK_QUEUE_RETRY_DELAY,
+    config.SLACK_QUEUE_RETRY_MAX_DELAY
+) if config.SLACK_EVENTS_MODE == 'queue' else None
+event_workers = []
+
+# Per-parent locks, so replies arriving together open only one Discord thread
+thread_locks = weakref.WeakValueDictionary()
+
+event_dedup = EventDeduplicator(
+    config.EVENT_DEDUP_TTL,
+    config.EVENT_DEDUP_MAX_SIZE,
+    collection=db.get_mongo_database()['Slack events'] if config.EVENT_DEDUP_BACKEND == 'mongo' else None
+)
 
 def slack_events():
-    global processed_files
-    # print('\n------ REQUEST ------\n', json.dumps(request.json, indent=4))
+    # Flask view for /slack/events
+    with tracing.span('slack_request', direction='slack->discord'):
+        status, response, event_data = check_request(request.get_data(), request.headers)
+        if event_data is not None:
+            # The trace id travels with the event through the queue
+            logs.bind(trace=tracing.inject(event_data))
+            try:
+                if event_queue is not None:
+                    # Отвечаем Slack сразу, событие обработают воркеры
+                    event_queue.put(event_data)
+                    response = {"status": "queued"}
+                else:
+                    response = handle_event(event_data)
+            except Exception:
+                forget_event(event_data)
+                raise
+
+    # The HTTP log in main.py reuses these instead of parsing the bodies again
+    g.slack_payload = event_data
+    g.slack_response = response
+    return jsonify(response), status
+
+async def slack_events_async(body, headers):
+    """ASGI counterpart of slack_events, awaited on the Discord loop.
+
+    Returns (status, response, event_data); event_data is the parsed payload,
+    for the HTTP log, or None when the request was answered without one.
+
+    The durable queue (SQLite insert and fsync) and a Mongo dedup store block, so
+    they run in worker threads; the in-memory checks are cheaper than a thread hop.
+    """
+    with tracing.span('slack_request', direction='slack->discord'):
+        if config.EVENT_DEDUP_BACKEND == 'mongo':
+            status, response, event_data = await asyncio.to_thread(check_request, body, headers)
+        else:
+            status, response, event_data = check_request(body, headers)
+        if event_data is None:
+            return status, response, None
+
+        logs.bind(trace=tracing.inject(event_data))
+        try:
+            if event_queue is not None:
+                await asyncio.to_thread(event_queue.put, event_data)
+                return 200, {"status": "queued"}, event_data
+
+            return 200, await handle_event_async(event_data), event_data
+        except Exception:
+            if config.EVENT_DEDUP_BACKEND == 'mongo':
+                await asyncio.to_thread(forget_event, event_data)
+            else:
+                forget_event(event_data)
+            raise
 
+def check_request(body, headers):
+    """Verify, parse and deduplicate a Slack request.
+
+    `body` is the raw request bytes: the signature is checked against them and
+    they are parsed once, with orjson when it is installed.
+
+    Returns (status, response, event_data); event_data is None when the request
+    is already answered by `response`.
+    """
     # Validate the request signature
-    if not signature_verifier.is_valid_request(request.get_data(), request.headers):
-        logging.error("Invalid request signature")
-        return jsonify({"error": "invalid request"}), 403
+    with metrics.stage('signature', direction='slack->discord'):
+        valid = signature_verifier.is_valid_request(body, headers)
+    if not valid:
+        logger.error("Invalid request signature")
+        return 403, {"error": "invalid request"}, None
 
-    event_data = request.json
+    try:
+        event_data = fastjson.loads(body)
+    except fastjson.JSONDecodeError:
+        return 400, {"error": "invalid payload"}, None
 
     if "type" in event_data and event_data["type"] == "url_verification":
-        logging.error("Challenge verification accepted")
-        return jsonify({"challenge": event_data["challenge"]})
+        logger.info("Challenge verification accepted")
+        return 200, {"challenge": event_data["challenge"]}, None
+
+    # Повторные доставки Slack (X-Slack-Retry-Num) отбрасываем до любых запросов к API
+    event_id = event_data.get("event_id")
+    if event_id and event_dedup.seen(event_id, headers.get('X-Slack-Retry-Num')):
+        logger.info('Duplicate Slack event %s ignored', event_id)
+        return 200, {"status": "duplicate"}, None
 
+    return 200, None, event_data
+
+def forget_event(event_data):
+    # Событие не поставлено в очередь или не обработано: повтор от Slack не должен считаться дубликатом
+    event_id = event_data.get("event_id")
+    if event_id:
+        event_dedup.forget(event_id)
+
+def handle_event(event_data):
+    # Called from Flask and queue worker threads
+    return run_on_discord_loop(handle_event_async(event_data), timeout=config.SLACK_EVENT_TIMEOUT)
+
+async def handle_event_async(event_data):
     event = event_data.get("event", {})
+    # Продолжаем трассу, начатую в slack_events (в том числе после очереди)
+    trace_id, parent_id = tracing.extract(event_data)
+    logs.bind(direction='slack->discord', channel=event.get('channel'), source=event.get('ts'), trace=trace_id)
+
+    with tracing.span('slack_event', trace_id, parent_id, event_type=event.get('type')):
+        return await route_event(event)
+
+async def route_event(event):
+    if event.get('type') == 'user_change':
+        user_directory.update(event['user'])
+        return {"status": "user updated"}
+
+    if event.get('type') in ('channel_rename', 'group_rename'):
+        channel_directory.invalidate(event['channel']['id'])
+        return {"status": "channel renamed"}
+
     user_id = event.get('user')
 
     if user_id != BOT_ID:
         # Проверяем, если это запрос типа file_share
         if event.get('subtype') == 'file_share':
-            if not check_file_id_existance(event):
+            if not await check_file_id_existance(event):
                 # Обрабатываем первый запрос типа file_share
-                    logger(f"""\n-------NEW FILE MESSAGE FROM SLACK-------\n---> {event.get('text')}""")
-                    slack_message_operator(event)
-                    return jsonify({"status": "file sent"})
+                    logger.debug('NEW FILE MESSAGE FROM SLACK: %s', event.get('text'))
+                    await slack_message_operator_async(event)
+                    return {"status": "file sent"}
             else:
-                logger('file_share request ignored')
-                return jsonify({"status": "file_share request ignored"})
+                logger.debug('file_share request ignored')
+                return {"status": "file_share request ignored"}
 
         # Игнорируем все запросы типа file_change
-        elif event_data['event'].get('subtype') == 'file_change':
-            logger("file_change request ignored.")
-            return jsonify({"status": "file_change request ignored."})
+        elif event.get('subtype') == 'file_change':
+            logger.debug("file_change request ignored.")
+            return {"status": "file_change request ignored."}
 
         elif event.get('text') != None:
-            logger(f"""\n-------NEW TEXT MESSAGE FROM SLACK-------\n---> {event.get('text')}""")
-            slack_message_operator(event)
-            return jsonify({"status": "ok"})
+            logger.debug('NEW TEXT MESSAGE FROM SLACK: %s', event.get('text'))
+            await slack_message_operator_async(event)
+            return {"status": "ok"}
         
         else:
-            return jsonify({"status": "no text found"})
+            return {"status": "no text found"}
     else:
-        logger('Request from this bot!')
-        return jsonify({"status": "bot text"})
+        logger.debug('Request from this bot!')
+        # Сообщение с файлами от бота: сообщаем ts ожидающему wait_message_ID
+        for file in event.get('files', []):
+            file_shares.notify_share(file['id'], event.get('ts'))
+        return {"status": "bot text"}
+
+def warm_directories():
+    """Pre-load users and the bridged channels so relayed messages skip the lookups."""
+    channel_directory.warm(list(SLACK_CHANNELS_DICT) + [config.SLACK_CHANNEL_DISCORD])
+    user_directory.warm()
+
+def start_event_workers():
+    """Start draining the event queue; safe to call on every Discord (re)connect."""
+    global event_workers
+    if event_queue is None or event_workers:
+        return
+    event_workers = start_workers(event_queue, handle_event, config.SLACK_QUEUE_WORKERS)
+    logger.info('Started %d Slack event workers', len(event_workers))
 
 #------------------------------------------
 # Helper functions to send message to Discord
@@ -77,278 +224,330 @@ async def slack_message_operator_async(event):
     from discord_bot import discord_client
 
     channel_id = event.get('channel')
-    channel_name = get_channel_name(channel_id)
+    channel_name = await get_channel_name_async(channel_id)
 
     if channel_id in SLACK_CHANNELS_DICT:
-        logger(f'SLACK - MESSAGE FROM - #{channel_name}')
+        logger.debug('SLACK - MESSAGE FROM - #%s', channel_name)
         discord_channel_id = SLACK_CHANNELS_DICT[channel_id]
         discord_channel = discord_client.get_channel(int(discord_channel_id))
     else:
-        logger(f'SLACK - MESSAGE FROM OTHER CHANNEL - #{channel_name}')
-        return jsonify({"status": "channel not handled"})
+        logger.debug('SLACK - MESSAGE FROM OTHER CHANNEL - #%s', channel_name)
+        return {"status": "channel not handled"}
         
     if 'files' in event:  # Check if the message contains files
-        logger('MESSAGE WITH IMAGE')
-        file_paths = await process_files_async(event)
+        logger.debug('MESSAGE WITH IMAGE')
+        files = await process_files_async(event)
     else:
-        logger('MESSAGE WITHOUT IMAGE')
-        file_paths = None
+        logger.debug('MESSAGE WITHOUT IMAGE')
+        files = None
 
     if event.get('thread_ts'):
-        logger(f'SLACK - MESSAGE IN THREAD')
+        logger.debug('SLACK - MESSAGE IN THREAD')
 
+        # The parent may still be waiting in a burst
+        await coalescer.flush_source(event.get('thread_ts'))
         try:
             # Пытаемся получить Discord message ID по Slack message ID
-            result = db.get_discord_message_id(event.get('thread_ts'))
-            logger("Discord message ID was found for this Slack message.")
-            send_thread_message_to_discord(event, discord_channel=discord_channel, discord_client=discord_client, file_paths=file_paths)
+            discord_message_id = await db.get_discord_message_id_async(event.get('thread_ts'))
+            logger.debug("Discord message ID was found for this Slack message.")
         except KeyError:
             # Если Slack message ID не найден, выводим сообщение об ошибке
-            logger("Error: Discord message ID not found for this Slack message.")
-            send_new_message_to_discord(event, discord_channel=discord_channel, slack_message_id=event.get('thread_ts'), discord_client=discord_client, file_paths=file_paths)
+            logger.info("Discord message ID not found for this Slack message, relaying as a new message")
+            return await send_new_message_to_discord_async(event, discord_channel=discord_channel, slack_message_id=event.get('thread_ts'), files=files)
+        return await send_thread_message_to_discord_async(event, discord_channel=discord_channel, discord_message_id=discord_message_id, files=files)
 
     elif event.get('ts'):
-        logger(f'SLACK - NEW MESSAGE IN CHANNEL')
-        send_new_message_to_discord(event, discord_channel=discord_channel, slack_message_id=event.get('ts'), discord_client=discord_client, file_paths=file_paths)
+        logger.debug('SLACK - NEW MESSAGE IN CHANNEL')
+        return await send_new_message_to_discord_async(event, discord_channel=discord_channel, slack_message_id=event.get('ts'), files=files)
         
     else:
-        logger('UNKNOWN MESSAGE FROM SLACK')
-        return jsonify({"status": "unknown message type"})
-
-def logger(log_text):
-    print(log_text)
-    logging.info(log_text)
+        logger.info('UNKNOWN MESSAGE FROM SLACK')
+        return {"status": "unknown message type"}
 
-async def send_thread_message_to_discord_async(event, discord_channel, file_paths):
+async def send_thread_message_to_discord_async(event, discord_channel, discord_message_id, files):
     try:
-        slack_message_id = event.get('thread_ts')
-        discord_message_id = db.get_discord_message_id(slack_message_id)    
-        user_text, user_name = get_user_data(event)
-        logger(f'Message from {user_name}')
+        user_text, user_name = await get_user_data(event)
+        logger.debug('Message from %s', user_name)
 
         # discord_channel = discord_client.get_channel(int(os.environ['DISCORD_CHANNEL_ID_TEST']))
 
         if discord_channel:
-            # Извлекаем сообщение по его ID
-            parent_message = await discord_channel.fetch_message(discord_message_id)
-
-            if parent_message:
-                user_text = format_mentions(event)
-                text = f'**💂_{user_name}_**\n{user_text}'
-
-                # Формируем часть текста из родительского сообщения для имени ветки (первые 5 слов)
-                parent_text = parent_message.content
-                thread_name = " ".join(parent_text.split()[:5])
-                thread_name = clean_and_format_thread_name(thread_name) if thread_name else "Discussion"
-                
-                # Проверяем, есть ли уже ветка для этого сообщения
-                if parent_message.thread:
-                    # Если ветка уже существует, просто отправляем сообщение в существующую ветку
-                    thread = parent_message.thread    
-                    result = await send_thread_message_operator(file_paths, text, thread)
-
-                    logger('Message sent in existing thread')
-                else:
-                    # Создаём новую ветку, если её нет
-                    thread = await parent_message.create_thread(
-                        name=f"{thread_name}",
-                    )
-                    result = await send_thread_message_operator(file_paths, text, thread)
-
-                    logger('Message sent in new thread')
+            text = f'**💂_{user_name}_**\n{user_text}'
+
+            thread_id = await db.get_thread_id_async(discord_message_id)
+            if thread_id:
+                # Ветка уже известна: отправляем сразу, без fetch_message
+                thread = get_known_thread(discord_channel, thread_id)
+                try:
+                    result = await send_thread_message_operator(files, text, thread)
+                except discord.NotFound:
+                    # Ветку удалили; при повторной обработке события будет создана новая
+                    await db.forget_thread_id_async(discord_message_id)
+                    raise
+                logger.info('Message sent in existing thread')
+            else:
+                thread = await open_thread(discord_channel, discord_message_id)
+                result = await send_thread_message_operator(files, text, thread)
+                logger.info('Message sent in new thread')
 
-                if result:
-                    logger("---> 'send_thread_message_to_discord_async' func is done")
+            if result:
+                logger.debug("'send_thread_message_to_discord_async' func is done")
 
-                    return jsonify({"status":"ok"})
-            else:
-                logger("Message not found in Discord channel.")
+                return {"status":"ok"}
     except Exception as e:
-        logger(f"Error: {e}")
+        logger.error("Error: %s", e)
+        raise
+
+def get_known_thread(discord_channel, thread_id):
+    from discord_bot import discord_client
+
+    # An archived thread is not in the cache, but a partial one still takes sends
+    return discord_channel.guild.get_thread(thread_id) \
+        or discord_client.get_partial_messageable(thread_id, guild_id=discord_channel.guild.id, type=discord.ChannelType.public_thread)
+
+async def open_thread(discord_channel, discord_message_id):
+    """Find or create the thread under `discord_message_id` and record it in the mapping store."""
+    lock = thread_locks.get(discord_message_id)
+    if lock is None:
+        lock = thread_locks[discord_message_id] = asyncio.Lock()
+
+    async with lock:
+        # A reply that held the lock before us may have opened the thread already
+        thread_id = await db.get_thread_id_async(discord_message_id)
+        if thread_id:
+            return get_known_thread(discord_channel, thread_id)
+
+        # Извлекаем сообщение по его ID
+        parent_message = await discord_channel.fetch_message(discord_message_id)
+
+        # Проверяем, есть ли уже ветка для этого сообщения
+        if parent_message.thread:
+            thread = parent_message.thread
+        else:
+            # Формируем часть текста из родительского сообщения для имени ветки (первые 5 слов)
+            thread_name = " ".join(parent_message.content.split()[:5])
+            thread_name = clean_and_format_thread_name(thread_name) if thread_name else "Discussion"
+            thread = await parent_message.create_thread(name=f"{thread_name}")
 
-async def send_thread_message_operator(file_paths, text, thread):
+        await db.save_thread_id_async(discord_message_id, thread.id)
+        return thread
+
+async def send_thread_message_operator(files, text, thread):
     max_length = 2000
-    logger(f'len text is {len(text)}!')
+    logger.debug('len text is %d', len(text))
 
     if len(text) >= max_length:
-        logger(f'Text is longer than {max_length}!')
-        result = await send_thread_message_by_parts(file_paths, thread, text, max_length)
+        logger.debug('Text is longer than %d!', max_length)
+        result = await send_thread_message_by_parts(files, thread, text, max_length)
         return result
     else:
-        logger(f'Text is less than {max_length}')
-        if file_paths:
-            logger('But the text has files')
-            result = await send_thread_message_with_files(file_paths, thread, text)
+        logger.debug('Text is less than %d', max_length)
+        if files:
+            logger.debug('But the text has files')
+            result = await send_thread_message_with_files(files, thread, text)
             return result
         else:
-            logger('And it has no files')
-            result = await thread.send(text)
+            logger.debug('And it has no files')
+            result = await send_to_discord(thread, text)
             return result
 
-async def send_thread_message_by_parts(file_paths, thread, text, max_length):
+async def send_thread_message_by_parts(files, thread, text, max_length):
     parts = split_text_by_parts(text, max_length)
-    logger(f'len texts is {len(parts)}')
+    logger.debug('len texts is %d', len(parts))
 
     for i, text in enumerate(parts):
         if i == len(parts)-1:
-            if file_paths:
-                logger(f'Text is longer than {max_length} and it has files!')
-                result = await send_thread_message_with_files(file_paths, thread, text)
+            if files:
+                logger.debug('Text is longer than %d and it has files!', max_length)
+                result = await send_thread_message_with_files(files, thread, text)
                 return result
             else:
-                logger(f'Text is longer than {max_length} and it has no files!')
-                result = await thread.send(text)
+                logger.debug('Text is longer than %d and it has no files!', max_length)
+                result = await send_to_discord(thread, text)
                 return result
         else:
-            await thread.send(text)
-            logger(f'---> Message sent:\n{text}')
+            await send_to_discord(thread, text)
+            logger.debug('Message part sent: %d characters', len(text))
 
-async def send_thread_message_with_files(file_paths, thread, text):
-    logger('Sending files in thread message')
+async def send_thread_message_with_files(files, thread, text):
+    logger.debug('Sending files in thread message')
 
-    files = [discord.File(path, filename=os.path.basename(path)) for path in file_paths]
-    result = await thread.send(text, files=files)
-    delete_files(file_paths)
+    try:
+        result = await send_to_discord(thread, text, files)
+    finally:
+        close_files(files)
     return result
 
-def get_user_data(event):
+async def send_to_discord(target, text, files=None):
+    """Send via the outbound dispatcher, in order with everything queued for `target`."""
+    async def send():
+        if not files:
+            return await target.send(text)
+        # A retried send must upload the attachments from the start again
+        for file in files:
+            file['file'].seek(0)
+        discord_files = [discord.File(file['file'], filename=file['filename']) for file in files]
+        return await target.send(text, files=discord_files)
+
+    return await outbound.submit(('discord', target.id), 'discord.messages', send)
+
+async def get_user_data(event):
+    from discord_bot import async_slack_client
+
     user_id = event.get('user')
-    user_text = format_mentions(event)
-    user_info = slack_client.users_info(user=user_id)['user']
+    user_text = await format_mentions(event)
+    user_info = await user_directory.get_async(async_slack_client, user_id)
     user_name = user_info['profile']['display_name'] or user_info['real_name']
     return user_text, user_name
 
-async def send_new_message_to_discord_async(event, discord_channel, slack_message_id, file_paths):
+async def send_new_message_to_discord_async(event, discord_channel, slack_message_id, files):
     try:
-        user_text, user_name = get_user_data(event)
-        logger(f'Message from {user_name}')
+        user_text, user_name = await get_user_data(event)
+        logger.debug('Message from %s', user_name)
 
-        text = f'**💂_{user_name}_**\n{user_text}'
+        header = f'**💂_{user_name}_**'
 
         if discord_channel:
-            message = await send_new_message_operator(file_paths, discord_channel, text)
-            logger('New message sent to discord')
-
-            message_id = message.id
-            db.save_message_to_db(slack_message_id, message_id)
-
-            logger("---> 'send_new_message_to_discord_async' func is done")
-            return jsonify({"status":"ok"})
+            async def deliver(text, slack_message_ids):
+                message = await send_new_message_operator(None, discord_channel, text)
+                return await save_new_message_mappings(slack_message_ids, message.id)
+
+            if not files and coalescer.accepts(header, user_text):
+                # The event is done once it joins the burst: a queue worker or webhook
+                # must not be held for the window. Delivery errors are logged by the coalescer.
+                coalescer.add(
+                    ('discord', discord_channel.id), event.get('user'), header, user_text, slack_message_id, deliver
+                )
+                return {"status": "coalesced"}
+
+            # Anything pending for this channel goes out first
+            await coalescer.drain_channel(('discord', discord_channel.id))
+            message = await send_new_message_operator(files, discord_channel, f'{header}\n{user_text}')
+            return await save_new_message_mappings([slack_message_id], message.id)
         
     except Exception as e:
-        logger(f"Error: {e}")
+        logger.error("Error: %s", e)
+        raise
+
+async def save_new_message_mappings(slack_message_ids, message_id):
+    from discord_bot import thread_parents
 
-async def send_new_message_operator(file_paths, discord_channel, text):
+    logger.info('New message sent to discord')
+    # A Discord thread opened on this message replies to the first Slack message
+    thread_parents.set(message_id, slack_message_ids[0])
+
+    # Каждое исходное сообщение получает свою запись, чтобы ответы на любое из них находили Discord-сообщение
+    for slack_message_id in slack_message_ids:
+        await db.save_message_to_db_async(slack_message_id, message_id)
+
+    logger.debug("'send_new_message_to_discord_async' func is done")
+    return {"status":"ok"}
+
+async def send_new_message_operator(files, discord_channel, text):
     max_length =2000
-    logger(f'len text is {len(text)}')
+    logger.debug('len text is %d', len(text))
     if len(text) >= max_length:
-        logger(f'Text is longer than {max_length}!')
-        result = await send_new_message_by_parts(file_paths, discord_channel, text, max_length)
+        logger.debug('Text is longer than %d!', max_length)
+        result = await send_new_message_by_parts(files, discord_channel, text, max_length)
         return result
     else:
-        logger(f'Text is less than {max_length}')
-        if file_paths:
-            logger('But the text has files')
-            result = await send_new_message_with_files(file_paths, discord_channel, text)
+        logger.debug('Text is less than %d', max_length)
+        if files:
+            logger.debug('But the text has files')
+            result = await send_new_message_with_files(files, discord_channel, text)
             return result 
         else:
-            logger('And it has no files')
-            result  = await discord_channel.send(text)
+            logger.debug('And it has no files')
+            result  = await send_to_discord(discord_channel, text)
             return result 
 
-async def send_new_message_by_parts(file_paths, discord_channel, text, max_length):
+async def send_new_message_by_parts(files, discord_channel, text, max_length):
     parts = split_text_by_parts(text, max_length)
-    logger(f'len texts is {len(parts)}')
+    logger.debug('len texts is %d', len(parts))
     for i, text in enumerate(parts):
         if i == len(parts)-1:
-            if file_paths:
-                logger(f'Text is longer than {max_length} and it has files!')
-                result = await send_new_message_with_files(file_paths, discord_channel, text)
+            if files:
+                logger.debug('Text is longer than %d and it has files!', max_length)
+                result = await send_new_message_with_files(files, discord_channel, text)
                 return result
             else:
-                logger(f'Text is longer than {max_length} and it has no files!')
-                result = await discord_channel.send(text)
+                logger.debug('Text is longer than %d and it has no files!', max_length)
+                result = await send_to_discord(discord_channel, text)
                 return result
         else:
-            await discord_channel.send(text)
-            logger(f'---> Message sent:\n{text}')
+            await send_to_discord(discord_channel, text)
+            logger.debug('Message part sent: %d characters', len(text))
 
-async def send_new_message_with_files(file_paths, discord_channel, text):
-    logger('Sending files in new message')
+async def send_new_message_with_files(files, discord_channel, text):
+    logger.debug('Sending files in new message')
 
-    files = [discord.File(path, filename=os.path.basename(path)) for path in file_paths]
-    result = await discord_channel.send(text, files=files)
-    delete_files(file_paths)
+    try:
+        result = await send_to_discord(discord_channel, text, files)
+    finally:
+        close_files(files)
     return result 
 
 async def process_files_async(event):
     # Извлекаем файлы и текст из сообщения Slack
     file_urls = []
-    files = event.get('files', [])
+    event_files = event.get('files', [])
 
     # Извлекаем URL файлов
-    for file in files:
+    for file in event_files:
         if file.get('url_private'):
             file_urls.append((file['url_private'], file['mimetype']))
 
     if not file_urls:
-        logger("No files found in the message.")
+        logger.debug("No files found in the message.")
         return None
 
     # Скачиваем файлы
-    file_paths = await download_files(file_urls)
+    files = await download_files(file_urls)
 
-    if not file_paths:
-        logger("No files were successfully downloaded.")
+    if not files:
+        logger.warning("No files were successfully downloaded.")
         return None
     
-    return file_paths
+    return files
 
 async def download_files(file_urls):
-    os.makedirs("temp_files", exist_ok=True)
-    file_paths = []
+    # Файлы качаются параллельно; порядок результатов совпадает с порядком в сообщении
+    per_message = asyncio.Semaphore(config.DOWNLOAD_CONCURRENCY_PER_MESSAGE)
+    files = await asyncio.gather(*(
+        download_file(url, mimetype, per_message) for url, mimetype in file_urls
+    ))
+    return [file for file in files if file]
+
+async def download_file(url, mimetype, per_message):
+    async with per_message, http_session.download_slots:
+        try:
+            headers = {'Authorization': f'Bearer {SLACK_TOKEN}'}
+            buffer = await http_session.download_to_buffer(url, headers=headers)
 
-    async with aiohttp.ClientSession() as session:
-        for url, mimetype in file_urls:
-            try:
-                headers = {'Authorization': f'Bearer {SLACK_TOKEN}'}
-                async with session.get(url, headers=headers) as response:
-                    if response.status == 200:
-                        # Создаем временный файл с правильным расширением
-                        ext = mimetype.split('/')[-1]
-                        file_name = f"temp_files/{url.split('/')[-1].split('?')[0]}"
-                        if not file_name.endswith(ext):
-                            file_name += f".{ext}"
-
-                        with open(file_name, 'wb') as f:
-                            f.write(await response.read())
-                        file_paths.append(file_name)
-                        logger(f"Downloaded file from Slack: {url}")
-                    else:
-                        logger(f"Failed to download file: {url}, Status: {response.status}")
-            except Exception as e:
-                logger(f"Error downloading file from {url}: {e}")
+            # Имя файла с правильным расширением
+            ext = mimetype.split('/')[-1]
+            file_name = url.split('/')[-1].split('?')[0]
+            if not file_name.endswith(ext):
+                file_name += f".{ext}"
 
-    return file_paths
+            logger.debug("Downloaded file from Slack: %s", url)
+            return {'file': buffer, 'filename': file_name}
+        except Exception as e:
+            logger.error("Error downloading file from %s: %r", url, e)
+    return None
 
 
 # ----------- Helper functions  -----------
-def slack_message_operator(event):
-    loop = asyncio.new_event_loop()  # Create a new event loop for this thread
-    asyncio.set_event_loop(loop)     # Set it as the current event loop
-    loop.run_until_complete(slack_message_operator_async(event))  # Run the async function
-       
-def send_thread_message_to_discord(event, discord_channel, discord_client, file_paths):
-    # Правильный запуск асинхронной функции с использованием event loop
-    asyncio.ensure_future(send_thread_message_to_discord_async(event, discord_channel, file_paths), loop=discord_client.loop)
-
-def send_new_message_to_discord(event, discord_channel, slack_message_id, discord_client, file_paths):
-    # Правильно запускаем асинхронную функцию с использованием event loop
-    asyncio.ensure_future(send_new_message_to_discord_async(event, discord_channel, slack_message_id, file_paths), loop=discord_client.loop)
-
-def process_files(event, discord_client):
-    # Правильный запуск асинхронной функции с использованием event loop
-    asyncio.ensure_future(process_files_async(event), loop=discord_client.loop)
+def run_on_discord_loop(coro, timeout=None):
+    """Run `coro` on the Discord loop from another thread; return its result or raise its error."""
+    from discord_bot import discord_client
+
+    future = asyncio.run_coroutine_threadsafe(coro, discord_client.loop)
+    try:
+        return future.result(timeout)
+    except concurrent.futures.TimeoutError:
+        future.cancel()
+        raise
 
 def clean_and_format_thread_name(raw_text):
    # Убираем часть с именем пользователя и любые звёздочки перед текстом
@@ -357,30 +556,28 @@ def clean_and_format_thread_name(raw_text):
     cleaned_text = cleaned_text.lstrip('*').strip()
     return cleaned_text
 
-def delete_files(file_paths):
-    """Delete files after they have been used."""
-    for file_path in file_paths:
-        try:
-            os.remove(file_path)
-            logger(f"Deleted image: {file_path}")
-        except Exception as e:
-            logger(f"Error deleting image {file_path}: {e}")
+def close_files(files):
+    """Release attachment buffers after they have been sent."""
+    for file in files:
+        file['file'].close()
+
+async def format_mentions(event):
+    from discord_bot import async_slack_client
 
-def format_mentions(event):
     user_text = event.get('text')
     mentions = re.findall(r'<@(\w+)>', user_text)
 
     if mentions:  
-        for mention in mentions:
+        for mention in set(mentions):
             try:
-                mention_info = slack_client.users_info(user=mention)
-                mention_name = mention_info['user']['real_name']
+                mention_info = await user_directory.get_async(async_slack_client, mention)
+                mention_name = mention_info['real_name']
                 user_text = user_text.replace(f'<@{mention}>', f'@{mention_name}')
             except Exception as e:
                 # Логируем ошибку, если не удалось получить информацию о пользователе
-                logger(f"Ошибка при получении информации для {mention}: {e}")
+                logger.error("Ошибка при получении информации для %s: %s", mention, e)
     else:
-        logger("Упоминаний не найдено.")
+        logger.debug("Упоминаний не найдено.")
     return user_text
     
 def split_text_by_parts(text, max_length):
@@ -406,53 +603,26 @@ def split_text_by_parts(text, max_length):
 
     return parts
 
-def get_channel_name(channel_id):
-    try:
-        # Запрос к Slack API для получения информации о канале
-        response = slack_client.conversations_info(channel=channel_id)
-        channel_name = response["channel"]["name"]
-        return channel_name
-    except SlackApiError as e:
-        logger(f"Ошибка при получении информации о канале: {e.response['error']}")
-        return None
+async def get_channel_name_async(channel_id):
+    from discord_bot import async_slack_client
+    return await channel_directory.get_name_async(async_slack_client, channel_id)
     
-def check_file_id_existance(event):
-    global processed_files
-    check_expired_files()
+async def check_file_id_existance(event):
     new_files = False
 
     if 'files' in event:
         for file in event['files']:
             file_id = file.get('id')
-            if file_id not in processed_files:
-                add_file_to_processed(file_id)
+            # Runs on the Discord loop: the shared Mongo store is written from a worker thread
+            if await processed_files.add_async(file_id):
                 new_files = True
-                logger('There is a new file!')
+                logger.debug('There is a new file!')
             else:
-                logger('File already exists!', file_id)
+                logger.debug('File already exists! %s', file_id)
 
         if new_files:
-            logger('New files!')
+            logger.debug('New files!')
             return False
         else:
-            logger('No new files!')
+            logger.debug('No new files!')
             return True
-
-def check_expired_files():
-    """Удаляет старые записи из processed_files по разнице времени."""
-    global processed_files
-
-    current_time = time.time()
-    expired_files = [file_id for file_id, timestamp in file_timestamps.items()
-                        if current_time - timestamp > EXPIRATION_TIME]
-    
-    for file_id in expired_files:
-        processed_files.remove(file_id)
-        del file_timestamps[file_id]
-
-def add_file_to_processed(file_id):
-    """Добавляет ID файла в processed_files и сохраняет время добавления."""
-    global processed_files
-
-    processed_files.add(file_id)
-    file_timestamps[file_id] = time.time()
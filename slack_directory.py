@@ -0,0 +1,95 @@
+from slack_sdk.errors import SlackApiError
+from dispatcher import record_failure
+from cache import TTLCache
+import metrics
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class UserDirectory:
+    """Cache of Slack user objects shared by author and mention resolution."""
+
+    def __init__(self, slack_client, ttl, maxsize):
+        self.slack_client = slack_client
+        self.cache = TTLCache(maxsize, ttl)
+
+    def warm(self):
+        """Load every workspace member from the paginated users.list."""
+        cursor = None
+        count = 0
+        try:
+            while True:
+                response = self.slack_client.users_list(limit=200, cursor=cursor)
+                for user in response['members']:
+                    self.cache.set(user['id'], user)
+                    count += 1
+
+                cursor = response.get('response_metadata', {}).get('next_cursor')
+                if not cursor:
+                    break
+        except SlackApiError as e:
+            logger.error("Error warming user directory: %s", e.response['error'])
+        logger.info('User directory warmed with %d users', count)
+
+    def update(self, user):
+        # Slack присылает полный объект пользователя в событии user_change
+        self.cache.set(user['id'], user)
+
+    async def get_async(self, async_client, user_id):
+        """The cached user object; a miss is fetched with users.info through the AsyncWebClient."""
+        user = self.cache.get(user_id)
+        if user is None:
+            try:
+                with metrics.stage('user_lookup'):
+                    user = (await async_client.users_info(user=user_id))['user']
+            except Exception as e:
+                record_failure(metrics.current_direction(), 'slack.users_info', e)
+                raise
+            self.cache.set(user_id, user)
+        return user
+
+
+class ChannelDirectory:
+    """Cache of Slack channel names, kept fresh by channel_rename events."""
+
+    def __init__(self, slack_client, ttl, maxsize):
+        self.slack_client = slack_client
+        self.cache = TTLCache(maxsize, ttl)
+
+    def warm(self, channel_ids):
+        for channel_id in channel_ids:
+            if channel_id:
+                self.get_name(channel_id)
+        logger.info('Channel directory warmed with %d channels', len(self.cache))
+
+    def invalidate(self, channel_id):
+        self.cache.pop(channel_id)
+
+    def get_name(self, channel_id):
+        channel_name = self.cache.get(channel_id)
+        if channel_name is None:
+            try:
+                # Запрос к Slack API для получения информации о канале
+                response = self.slack_client.conversations_info(channel=channel_id)
+                channel_name = response["channel"]["name"]
+                self.cache.set(channel_id, channel_name)
+            except SlackApiError as e:
+                logger.error("Ошибка при получении информации о канале: %s", e.response['error'])
+                return None
+        return channel_name
+
+    async def get_name_async(self, async_client, channel_id):
+        """Same as get_name, but a cache miss goes through the AsyncWebClient."""
+        channel_name = self.cache.get(channel_id)
+        if channel_name is None:
+            try:
+                with metrics.stage('channel_lookup'):
+                    response = await async_client.conversations_info(channel=channel_id)
+                channel_name = response["channel"]["name"]
+                self.cache.set(channel_id, channel_name)
+            except SlackApiError as e:
+                record_failure(metrics.current_direction(), 'slack.conversations_info', e)
+                logger.error("Ошибка при получении информации о канале: %s", e.response['error'])
+                return None
+        return channel_name
@@ -0,0 +1,207 @@
+from contextlib import contextmanager
+from urllib import request as urllib_request
+import contextvars
+import threading
+import logging
+import atexit
+import queue
+import time
+import json
+import os
+import logs
+import config
+
+logger = logging.getLogger(__name__)
+
+# Лёгкая трассировка внутри процесса: span на каждый этап, связь через contextvars.
+# Готовые span'ы уходят в очередь и пишутся отдельным потоком (JSONL или OTLP/HTTP).
+
+# Envelope key that carries the trace of a Slack event through the durable queue
+ENVELOPE_KEY = 'relay_trace'
+
+_current = contextvars.ContextVar('trace_span', default=None)
+_exporter = None
+
+
+class Span:
+    __slots__ = ('trace_id', 'span_id', 'parent_id', 'name', 'start_ns', 'end_ns', 'attributes', 'error')
+
+    def __init__(self, name, trace_id, parent_id, attributes):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.error = None
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_ns": self.start_ns,
+            "duration_ms": (self.end_ns - self.start_ns) / 1e6,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+def new_trace_id():
+    return os.urandom(16).hex()
+
+
+@contextmanager
+def span(name, trace_id=None, parent_id=None, **attributes):
+    """Record the enclosed block as a span.
+
+    Without `trace_id` the span joins the trace of the current span, or starts a
+    new trace. Tasks and run_coroutine_threadsafe calls started inside the block
+    inherit it as their parent. Costs nothing beyond a check when tracing is off.
+    """
+    if _exporter is None:
+        yield None
+        return
+
+    parent = _current.get()
+    if trace_id is None:
+        if parent is not None:
+            trace_id, parent_id = parent.trace_id, parent.span_id
+        else:
+            trace_id = new_trace_id()
+    # Направление, канал и ID исходного сообщения берутся из контекста логов
+    context = {key: value for key, value in logs.current_context().items() if key != 'trace'}
+    current = Span(name, trace_id, parent_id, {**context, **attributes})
+    token = _current.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = repr(e)
+        raise
+    finally:
+        current.end_ns = time.time_ns()
+        _current.reset(token)
+        _exporter.export(current)
+
+
+def inject(envelope):
+    """Store the current trace in a Slack event envelope before it is queued.
+
+    Returns the trace id; a new one is started if there is no current span.
+    """
+    current = _current.get()
+    if current is not None:
+        envelope[ENVELOPE_KEY] = [current.trace_id, current.span_id]
+    else:
+        envelope[ENVELOPE_KEY] = [new_trace_id(), None]
+    return envelope[ENVELOPE_KEY][0]
+
+
+def extract(envelope):
+    """(trace_id, parent span id) stored by inject, or a new trace for envelopes without one."""
+    trace_id, parent_id = envelope.get(ENVELOPE_KEY) or (new_trace_id(), None)
+    return trace_id, parent_id
+
+
+class JSONLWriter:
+    def __init__(self, path):
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def write(self, spans):
+        for finished in spans:
+            self.file.write(json.dumps(finished.to_dict(), ensure_ascii=False) + '\n')
+        self.file.flush()
+
+
+class OTLPWriter:
+    """Sends spans to an OTLP/HTTP collector as JSON (e.g. http://localhost:4318/v1/traces)."""
+
+    def __init__(self, endpoint, service_name):
+        self.endpoint = endpoint
+        self.service_name = service_name
+
+    def write(self, spans):
+        body = {"resourceSpans": [{
+            "resource": {"attributes": [otlp_attribute('service.name', self.service_name)]},
+            "scopeSpans": [{"scope": {"name": "relay"}, "spans": [self.otlp_span(finished) for finished in spans]}],
+        }]}
+        req = urllib_request.Request(
+            self.endpoint, data=json.dumps(body).encode(), headers={'Content-Type': 'application/json'}
+        )
+        with urllib_request.urlopen(req, timeout=10) as response:
+            response.read()
+
+    @staticmethod
+    def otlp_span(finished):
+        result = {
+            "traceId": finished.trace_id,
+            "spanId": finished.span_id,
+            "name": finished.name,
+            "kind": 1,
+            "startTimeUnixNano": str(finished.start_ns),
+            "endTimeUnixNano": str(finished.end_ns),
+            "attributes": [otlp_attribute(key, value) for key, value in finished.attributes.items()],
+            "status": {"code": 2, "message": finished.error} if finished.error else {"code": 1},
+        }
+        if finished.parent_id:
+            result["parentSpanId"] = finished.parent_id
+        return result
+
+
+def otlp_attribute(key, value):
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+class Exporter:
+    """Hands finished spans to a writer on a background thread, in batches."""
+
+    def __init__(self, writer, batch_size=512, interval=1.0):
+        self.writer = writer
+        self.batch_size = batch_size
+        self.interval = interval
+        self._queue = queue.SimpleQueue()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='trace-exporter', daemon=True)
+        self._thread.start()
+
+    def export(self, finished):
+        self._queue.put(finished)
+
+    def _run(self):
+        while not self._stop.is_set() or not self._queue.empty():
+            batch = []
+            try:
+                batch.append(self._queue.get(timeout=self.interval))
+                while len(batch) < self.batch_size:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            if not batch:
+                continue
+            try:
+                self.writer.write(batch)
+            except Exception as e:
+                logger.warning('Dropped %d spans: %s', len(batch), e)
+
+    def shutdown(self):
+        self._stop.set()
+        self._thread.join(timeout=self.interval + 10)
+
+
+def setup():
+    """Start exporting spans as configured by TRACE_EXPORTER; called once at startup."""
+    global _exporter
+    if config.TRACE_EXPORTER == 'jsonl':
+        writer = JSONLWriter(config.TRACE_FILE)
+    elif config.TRACE_EXPORTER == 'otlp':
+        writer = OTLPWriter(config.TRACE_OTLP_ENDPOINT, config.TRACE_SERVICE_NAME)
+    else:
+        return
+    _exporter = Exporter(writer)
+    atexit.register(_exporter.shutdown)